@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Micro-benchmarks for alo. They run without a database.
+
+    python benchmarks/bench.py                       # run everything
+    python benchmarks/bench.py -k parameters         # only matching names
+    python benchmarks/bench.py --save results.json   # record the run
+    python benchmarks/bench.py --compare results.json
+
+`--save` appends the run, tagged with the current git commit, to a JSON
+file. `--compare` prints the change against the last run saved in that file.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import django
+from django.conf import settings
+
+settings.configure(
+    SECRET_KEY='benchmarks',
+    INSTALLED_APPS=['django.contrib.auth', 'django.contrib.contenttypes', 'alo'],
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+    GEOS_LIBRARY_PATH=os.environ.get('GEOS_LIBRARY_PATH'),
+    GDAL_LIBRARY_PATH=os.environ.get('GDAL_LIBRARY_PATH'),
+    USE_I18N=False,
+)
+django.setup()
+
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from alo import forms, instrumentation
+from alo.decorators import validate
+from alo.operators import AND, OR
+
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """
+    Register a benchmark. The decorated function sets it up and returns the
+    callable that is timed.
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return decorator
+
+
+def make_form(size, depth=0, base=forms.QueryForm):
+    """
+    A `QueryForm` with `size` optional integer fields and, if `depth` is
+    given, `AND`/`OR` rules nested `depth` levels deep over them.
+    """
+    names = ['f%d' %i for i in range(size)]
+    attrs = dict((name, forms.IntegerField(required=False)) for name in names)
+    extralogic = []
+    if depth:
+        for start in range(0, size - depth, depth + 1):
+            chunk = names[start:start + depth + 1]
+            rule = chunk[-1]
+            for i,name in enumerate(reversed(chunk[:-1])):
+                rule = (OR if i % 2 else AND)(name, rule)
+            extralogic.append(rule if depth > 1 else AND(*chunk))
+    attrs['Meta'] = type('Meta', (object,), {'extralogic': extralogic})
+    return type(base)('Form%d_%d' %(size, depth), (base,), attrs), names
+
+
+@benchmark('QueryForm() 5 fields')
+def form_init_small():
+    Form, names = make_form(5)
+    data = {'f0': '1'}
+    return lambda: Form(data)
+
+
+@benchmark('QueryForm() 30 fields')
+def form_init_large():
+    Form, names = make_form(30)
+    data = {'f0': '1'}
+    return lambda: Form(data)
+
+
+@benchmark('QueryForm() 30 fields, copy_fields_on_write')
+def form_init_large_shared():
+    Form, names = make_form(30)
+    Form._meta.copy_fields_on_write = True
+    Form.set_base_fields(Form._meta)
+    data = {'f0': '1'}
+    return lambda: Form(data)
+
+
+@benchmark('QueryModelForm() User')
+def model_form_init():
+    class Form(forms.QueryModelForm):
+        class Meta:
+            model = User
+            fields = ('first_name', 'last_name', 'email')
+            extralogic = [AND('first_name', 'last_name')]
+    data = {'first_name': 'a', 'last_name': 'b'}
+    return lambda: Form(data)
+
+
+def is_valid(size, depth, filled):
+    Form, names = make_form(size, depth)
+    data = dict((name, '1') for name in names[:filled])
+    def run():
+        form = Form(data)
+        form.is_valid()
+    return run
+
+
+for size,depth in [(5, 0), (30, 0), (30, 1), (30, 2), (30, 4)]:
+    benchmark('is_valid() %d fields, depth %d' %(size, depth))(
+        lambda size=size, depth=depth: is_valid(size, depth, size))
+
+benchmark('is_valid() 30 fields, depth 4, empty')(lambda: is_valid(30, 4, 0))
+benchmark('is_valid() 200 fields, depth 2')(lambda: is_valid(200, 2, 200))
+
+
+def clean_extralogic(size, depth, filled):
+    """
+    Only alo's part of `full_clean`, on an already cleaned form.
+    """
+    Form, names = make_form(size, depth)
+    form = Form(dict((name, '1') for name in names[:filled]))
+    form.is_valid()
+    return form.clean_extralogic
+
+
+for size in (30, 200):
+    benchmark('clean_extralogic() %d fields, depth 2' %size)(
+        lambda size=size: clean_extralogic(size, 2, size))
+    # Whole rules left empty, so that every rule still passes
+    benchmark('clean_extralogic() %d fields, depth 2, half empty' %size)(
+        lambda size=size: clean_extralogic(size, 2, size // 6 * 3))
+
+
+@benchmark('is_valid() 30 fields, depth 2, MemoryRecorder')
+def is_valid_recorded():
+    run = is_valid(30, 2, 30)
+    recorder = instrumentation.MemoryRecorder()
+    def recorded():
+        instrumentation.add_recorder(recorder)
+        try:
+            run()
+        finally:
+            instrumentation.remove_recorder(recorder)
+    return recorded
+
+
+@benchmark('100 payloads, one form each')
+def many_forms():
+    Form, names = make_form(10, 2)
+    payloads = [dict((name, str(i)) for name in names) for i in range(100)]
+    def run():
+        for data in payloads:
+            form = Form(data)
+            if form.is_valid():
+                form.parameters
+    return run
+
+
+@benchmark('100 payloads, validate_many()')
+def validate_many():
+    Form, names = make_form(10, 2)
+    payloads = [dict((name, str(i)) for name in names) for i in range(100)]
+    def run():
+        for result in Form.validate_many(payloads):
+            pass
+    return run
+
+
+@benchmark('parameters with multifield_lookups')
+def parameters():
+    class Form(forms.QueryForm):
+        year = forms.IntegerField(required=False)
+        range = forms.IntegerField(required=False, initial=1)
+        title = forms.CharField(required=False)
+
+        class Meta:
+            lookups = {'year': 'publication_date__year', 'title': 'title__icontains'}
+            multifield_lookups = {
+                ('year', 'range'): lambda year,range: {
+                    'publication_date__year__range': (year-range, year+range)
+                },
+            }
+            extralogic = [AND('range', 'year')]
+    form = Form({'year': '2000', 'title': 'alo'})
+    form.is_valid()
+    def run():
+        form.__dict__.pop('_parameters', None)
+        form.get_parameters()
+    return run
+
+
+@benchmark('parameters after changing an ungrouped field')
+def parameters_changed():
+    class Form(forms.QueryForm):
+        year = forms.IntegerField(required=False)
+        range = forms.IntegerField(required=False, initial=1)
+        title = forms.CharField(required=False)
+
+        class Meta:
+            multifield_lookups = {
+                ('year', 'range'): lambda year,range: {
+                    'publication_date__year__range': (year-range, year+range)
+                },
+            }
+    form = Form({'year': '2000', 'title': 'alo'})
+    form.is_valid()
+    titles = ['alo', 'ola']
+    def run():
+        titles.reverse()
+        form._validated_data['title'] = titles[0]
+        form.get_parameters()
+    return run
+
+
+@benchmark('CoordsField.clean()')
+def coords_field():
+    if not hasattr(forms, 'CoordsField'):
+        return None
+    field = forms.CoordsField()
+    return lambda: field.clean('-8.1,40.0')
+
+
+@benchmark('BoundingBoxField.clean()')
+def bounding_box_field():
+    if not hasattr(forms, 'BoundingBoxField'):
+        return None
+    field = forms.BoundingBoxField()
+    return lambda: field.clean(['-8.1,40.0', '-9.1,41.0'])
+
+
+@benchmark('BoundingBoxField.clean() + polygon')
+def bounding_box_polygon():
+    if not hasattr(forms, 'BoundingBoxField'):
+        return None
+    field = forms.BoundingBoxField()
+    return lambda: field.clean(['-8.1,40.0', '-9.1,41.0']).geometry
+
+
+@benchmark('BoundingBoxField(as_extent=True).clean()')
+def bounding_box_extent():
+    if not hasattr(forms, 'BoundingBoxField'):
+        return None
+    field = forms.BoundingBoxField(as_extent=True)
+    return lambda: field.clean(['-8.1,40.0', '-9.1,41.0'])
+
+
+@benchmark('MultiCoordsField.clean() 1000 points')
+def multi_coords_field():
+    if not hasattr(forms, 'MultiCoordsField'):
+        return None
+    field = forms.MultiCoordsField(geometry='linestring')
+    value = ';'.join('%s,%s' %(i % 180 - 90, i % 90 - 45) for i in range(1000))
+    return lambda: field.clean(value)
+
+
+@benchmark('validate() round trip')
+def validate_round_trip():
+    Form, names = make_form(10, 2)
+    view = validate(Form)(lambda request: HttpResponse('success'))
+    request = RequestFactory().get('', dict((name, '1') for name in names))
+    return lambda: view(request)
+
+
+@benchmark('validate() round trip, invalid')
+def validate_round_trip_invalid():
+    Form, names = make_form(10, 2)
+    view = validate(Form)(lambda request: HttpResponse('success'))
+    request = RequestFactory().get('', {names[0]: '1'})
+    return lambda: view(request)
+
+
+def import_time(statement):
+    """
+    Time `statement` in a fresh interpreter with Django configured.
+    """
+    code = '; '.join([
+        'from django.conf import settings',
+        'import os',
+        'settings.configure(GEOS_LIBRARY_PATH=os.environ.get("GEOS_LIBRARY_PATH"), '
+        'GDAL_LIBRARY_PATH=os.environ.get("GDAL_LIBRARY_PATH"))',
+        statement,
+    ])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    return lambda: subprocess.check_call([sys.executable, '-c', code], env=env)
+
+
+benchmark('python -c "import django.forms"')(
+    lambda: import_time('import django.forms'))
+benchmark('python -c "import alo.forms"')(
+    lambda: import_time('import alo.forms'))
+
+
+@benchmark('python -c "import alo.forms" + geo fields')
+def import_geo_fields():
+    if not hasattr(forms, 'CoordsField'):
+        return None
+    return import_time('import alo.forms; alo.forms.CoordsField')
+
+
+def measure(func, repeat, min_time=0.2):
+    number = 1
+    while timeit.timeit(func, number=number) < min_time:
+        number *= 2
+    best = min(timeit.repeat(func, number=number, repeat=repeat))
+    return best / number * 1e6
+
+
+def get_commit():
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def load(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-k', dest='keyword', help='only run matching benchmarks')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='FILE', help='append the results to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='compare with the last run in FILE')
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        runs = load(args.compare)
+        if runs:
+            previous = runs[-1]['results']
+
+    results = {}
+    for name,setup in BENCHMARKS:
+        if args.keyword and args.keyword not in name:
+            continue
+        func = setup()
+        if func is None:
+            print('%-50s %12s' %(name, 'skipped'))
+            continue
+        results[name] = measure(func, args.repeat)
+        line = '%-50s %10.2f us' %(name, results[name])
+        if name in previous:
+            line += '  %+6.1f%%' %((results[name] / previous[name] - 1) * 100)
+        print(line)
+
+    if args.save:
+        runs = load(args.save)
+        runs.append({
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'results': results,
+        })
+        with open(args.save, 'w') as f:
+            json.dump(runs, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
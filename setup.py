@@ -22,6 +22,7 @@ setup(
     classifiers      = [
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 2',
+        'Programming Language :: Python :: 3',
         'Intended Audience :: Developers',
     ]
 )
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class AloConfig(AppConfig):
+    name = 'alo'
+
+    def ready(self):
+        if getattr(settings, 'ALO_CACHE_SIGNALS', True):
+            from .cache import connect
+            connect()
@@ -0,0 +1,98 @@
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test.client import RequestFactory
+from django.http import Http404, HttpResponse
+from .forms import QueryForm, QueryModelForm, Field
+from .operators import AND
+from .decorators import validate
+
+
+class AsyncValidateTestCase(TestCase):
+
+    def test_validate_decorator(self):
+
+        class Form(QueryForm):
+            a = Field(required=False)
+            b = Field(required=False)
+
+            class Meta:
+                extralogic = [AND('a', 'b'),]
+
+        async def view(request):
+            return HttpResponse('success')
+
+        factory = RequestFactory()
+        wrapper = validate(Form)(view)
+        self.assertEqual(wrapper.__name__, view.__name__)
+        request = factory.get('', {'a':1})
+        response = async_to_sync(wrapper)(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(request.form.is_valid())
+        request = factory.get('', {'a':1, 'b':1})
+        self.assertEqual(async_to_sync(wrapper)(request).content, b'success')
+
+        wrapper = validate(Form, memoize=1)(view)
+        for i in range(2):
+            request = factory.get('', {'a':1})
+            self.assertEqual(async_to_sync(wrapper)(request).status_code, 400)
+            self.assertEqual(request.form.parameters, {'a': '1'})
+
+    def test_validate_decorator_with_instance(self):
+
+        class Form(QueryModelForm):
+            class Meta:
+                model = User
+                fields = ('username', 'email')
+                extralogic = [AND('username', 'email'),]
+
+        async def view(request, pk):
+            return HttpResponse('success')
+
+        user = User.objects.create(username='user', email='user@email')
+        factory = RequestFactory()
+        wrapper = validate(Form)(view)
+        request = factory.get('', {'username':'user', 'email':'1@email.com'})
+        response = async_to_sync(wrapper)(request, pk=user.pk)
+        self.assertEqual(response.content, b'success')
+        self.assertEqual(request.form.instance, user)
+        request = factory.get('', {'username':'user'})
+        response = async_to_sync(wrapper)(request, pk=user.pk)
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(Http404):
+            async_to_sync(wrapper)(request, pk=user.pk + 1)
+
+    def test_clean_in_thread(self):
+        from django.core.exceptions import SynchronousOnlyOperation
+        from .async_views import cleans_in_thread
+
+        class Form(QueryForm):
+            a = Field(required=False)
+
+            def clean_a(self):
+                return User.objects.count()
+
+        class DefaultForm(QueryForm):
+            a = Field(required=False, initial=lambda: User.objects.count())
+
+        class PlainForm(QueryForm):
+            a = Field(required=False)
+
+        self.assertTrue(cleans_in_thread(Form))
+        self.assertTrue(cleans_in_thread(DefaultForm))
+        self.assertFalse(cleans_in_thread(PlainForm))
+
+        async def view(request):
+            return HttpResponse(str(request.form.parameters['a']))
+
+        User.objects.create(username='user')
+        factory = RequestFactory()
+        for form_class in (Form, DefaultForm):
+            wrapper = validate(form_class)(view)
+            request = factory.get('', {'a': '1'} if form_class is Form else {})
+            self.assertEqual(async_to_sync(wrapper)(request).content, b'1')
+        wrapper = validate(Form, clean_in_thread=False)(view)
+        with self.assertRaises(SynchronousOnlyOperation):
+            async_to_sync(wrapper)(factory.get('', {'a': '1'}))
+        wrapper = validate(PlainForm, clean_in_thread=True)(view)
+        self.assertEqual(async_to_sync(wrapper)(factory.get('', {'a': '1'})).content, b'1')
@@ -0,0 +1,93 @@
+"""
+Coroutine counterpart of the `validate` decorator. Imported by
+`alo.decorators.validate` when the decorated view is a coroutine function;
+requires Python 3 and Django 3.1 or newer.
+"""
+from asgiref.sync import sync_to_async
+from django.forms import Form, ModelForm, ModelChoiceField
+from django.http import Http404
+from functools import wraps
+from timeit import default_timer
+from .decorators import copy_form
+from .instrumentation import RECORDERS, timing
+
+
+def cleans_in_thread(form_class):
+    """
+    Whether cleaning `form_class` may query the database, in which case it
+    has to run outside the event loop: model forms, model choice fields,
+    callable defaults and `clean` methods of its own. Queries made by
+    custom fields or validators are not detected.
+    """
+    from .forms import QueryForm
+    if issubclass(form_class, ModelForm):
+        return True
+    if any(isinstance(field, ModelChoiceField)
+           for field in form_class.base_fields.values()):
+        return True
+    if getattr(getattr(form_class, '_meta', None), 'callable_defaults', ()):
+        return True
+    base = QueryForm if issubclass(form_class, QueryForm) else Form
+    return any(
+        getattr(form_class, name) is not getattr(base, name, None)
+        for name in dir(form_class) if name.startswith('clean')
+    )
+
+
+async def aget_instance(model, pk):
+    manager = model._default_manager
+    try:
+        if hasattr(manager, 'aget'):
+            return await manager.aget(pk=pk)
+        return await sync_to_async(manager.get)(pk=pk)
+    except model.DoesNotExist:
+        raise Http404('No %s matches the given query.' %model._meta.object_name)
+
+
+def validate_async(decorator, view):
+    form_class = decorator.form_class
+    in_thread = decorator.clean_in_thread
+    if in_thread is None:
+        in_thread = cleans_in_thread(form_class)
+
+    def clean(form_kwargs):
+        form = form_class(**form_kwargs)
+        form.is_valid()
+        return form
+
+    aclean = sync_to_async(clean)
+    position = []
+
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        request = decorator.get_request(args, position)
+        key = None
+        if decorator.memo is not None:
+            key = decorator.get_memo_key(request, kwargs)
+        memoized = decorator.memo.get(key) if key is not None else None
+        if memoized is None:
+            form_kwargs = decorator.get_form_kwargs(request)
+            value = decorator.get_instance_pk(kwargs)
+            if value != None:
+                start = default_timer()
+                form_kwargs['instance'] = await aget_instance(decorator.model, value)
+                if RECORDERS:
+                    timing(form_class, 'get_instance', default_timer() - start)
+            form = await aclean(form_kwargs) if in_thread else clean(form_kwargs)
+            response = None
+            if not form.is_valid():
+                response = decorator.error_response(form)
+            if key is not None:
+                decorator.memo.set(key, (form, response))
+                form = copy_form(form)
+        else:
+            form, response = memoized
+            form = copy_form(form)
+            if response is not None:
+                response = decorator.copy_response(response)
+        request.form = form
+        if response is None:
+            return await view(*args, **kwargs)
+        return response
+
+    return wrapper
@@ -0,0 +1,181 @@
+"""
+Optional cache for the rows a queryset returns once filtered by a form.
+
+Entries are keyed on the normalized `form.parameters` and versioned per
+model: saving or deleting a row of the queryset's model, or of a model it
+joins to, bumps its version, which makes every cached result that read
+from that model stale.
+"""
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db.models import Model, Q
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.contrib.gis.measure import Distance
+import datetime
+import decimal
+import hashlib
+import time
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:
+    from django.db.models.sql.datastructures import EmptyResultSet
+
+
+def get_cache():
+    return caches[getattr(settings, 'ALO_CACHE', 'default')]
+
+
+def get_model_label(model):
+    return '%s.%s' %(model._meta.app_label, model._meta.model_name)
+
+
+def normalize(value):
+    """
+    Turn a `parameters` value into a hashable structure that is equal for
+    equal inputs, whatever the dict or set ordering.
+    """
+    if isinstance(value, Mapping):
+        return tuple(sorted(
+            ((normalize(k), normalize(v)) for k,v in value.items()), key=repr))
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(each) for each in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted((normalize(each) for each in value), key=repr))
+    if isinstance(value, Q):
+        children = sorted((normalize(each) for each in value.children), key=repr)
+        return (value.connector, value.negated, tuple(children))
+    if hasattr(value, 'hexewkb'):
+        return ('geometry', value.hexewkb)
+    if isinstance(value, Distance):
+        return ('distance', value.m)
+    if isinstance(value, Model):
+        return (get_model_label(value.__class__), value.pk)
+    if isinstance(value, QuerySet):
+        return (get_model_label(value.model), get_sql(value))
+    if isinstance(value, (datetime.date, datetime.time)):
+        return (value.__class__.__name__, value.isoformat())
+    if isinstance(value, decimal.Decimal):
+        return ('decimal', str(value))
+    return value
+
+
+def make_key(parameters):
+    return normalize(parameters)
+
+
+def get_version_key(model):
+    return 'alo:version:%s' %get_model_label(model)
+
+
+def new_version():
+    # Unlike a counter restarted at 1, an evicted version key never comes
+    # back with a value older entries were keyed on
+    return int(time.time() * 1000)
+
+
+def get_versions(models):
+    """
+    The current versions of `models`, in the order given.
+    """
+    cache = get_cache()
+    keys = [get_version_key(each) for each in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, new_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def get_version(model):
+    return get_versions([model])[0]
+
+
+def invalidate(model):
+    cache = get_cache()
+    try:
+        cache.incr(get_version_key(model))
+    except ValueError:
+        cache.set(get_version_key(model), new_version(), None)
+
+
+def invalidate_sender(sender, **kwargs):
+    invalidate(sender)
+
+
+def invalidate_m2m(sender, instance, model, **kwargs):
+    for each in (sender, instance.__class__, model):
+        invalidate(each)
+
+
+def connect():
+    """
+    Invalidate the cached results of a model whenever one of its rows is
+    saved or deleted or one of its many-to-many relations changes, in
+    every model. Called by `AloConfig.ready()`, so that processes which
+    never read the cache (workers, management commands) invalidate it too.
+    """
+    post_save.connect(invalidate_sender, dispatch_uid='alo.cache')
+    post_delete.connect(invalidate_sender, dispatch_uid='alo.cache')
+    m2m_changed.connect(invalidate_m2m, dispatch_uid='alo.cache')
+
+
+def get_sql(queryset):
+    """
+    The SQL of `queryset`, or `None` when it cannot match any row (e.g.
+    `none()` or `pk__in=[]`), which Django does not turn into SQL.
+    """
+    try:
+        return str(queryset.query)
+    except EmptyResultSet:
+        return None
+
+
+def get_models(queryset):
+    """
+    The model of `queryset` and every model whose table it joins, such as
+    `Group` for `User.objects.filter(groups__name=...)`. Tables queried in
+    subqueries or raw SQL are not found.
+    """
+    tables = set(getattr(each, 'table_name', None) for each in queryset.query.alias_map.values())
+    models = set([queryset.model])
+    for model in apps.get_models(include_auto_created=True):
+        if model._meta.db_table in tables:
+            models.add(model)
+    return sorted(models, key=get_model_label)
+
+
+def get_cache_key(form, queryset, alternatives=False, models=None):
+    if alternatives:
+        key = (make_key(form.as_q(alternatives=True)), get_sql(queryset))
+    else:
+        key = (make_key(form.parameters), get_sql(queryset))
+    if models is None:
+        models = get_models(form.apply(queryset, alternatives=alternatives))
+    digest = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+    versions = ':'.join(str(each) for each in get_versions(models))
+    return 'alo:%s:%s:%s' %(get_model_label(queryset.model), versions, digest)
+
+
+def cached_queryset(form, queryset, timeout=DEFAULT_TIMEOUT, alternatives=False):
+    """
+    Return the rows of `queryset` filtered by `form` as a list, reading
+    them from the cache when the same parameters were seen before.
+    """
+    filtered = form.apply(queryset, alternatives=alternatives)
+    models = get_models(filtered)
+    cache = get_cache()
+    key = get_cache_key(form, queryset, alternatives=alternatives, models=models)
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(filtered)
+        cache.set(key, rows, timeout)
+    return rows
@@ -0,0 +1,166 @@
+"""
+Lightweight values returned by the geo fields. They hold plain floats and
+only build the GEOS geometry when it is asked for, e.g. by
+`form.parameters`, so that forms failing validation or ignoring the field
+never allocate it.
+"""
+import math
+
+
+# WGS84: a degree of latitude is at least 110574 m long, a degree of
+# longitude at most 111320 m (on the equator)
+METERS_PER_DEGREE_LATITUDE = 110574.0
+METERS_PER_DEGREE_LONGITUDE = 111320.0
+
+
+class LazyGeometry(object):
+    __slots__ = ('_geometry',)
+
+    def __init__(self):
+        self._geometry = None
+
+    @property
+    def geometry(self):
+        if self._geometry is None:
+            self._geometry = self.create_geometry()
+        return self._geometry
+
+    def create_geometry(self):
+        raise NotImplementedError
+
+    def resolve(self):
+        """
+        The value to use in a lookup.
+        """
+        return self.geometry
+
+    def __getattr__(self, name):
+        # Everything else (num_points, srid, wkt, ...) comes from the geometry
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.geometry, name)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyGeometry):
+            other = other.geometry
+        elif other is None or other == '' or isinstance(other, (list, tuple, dict)):
+            # `value in field.empty_values` must not build the geometry
+            return NotImplemented
+        return self.geometry == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+class Coords(LazyGeometry):
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        super(Coords, self).__init__()
+        self.x = x
+        self.y = y
+
+    @property
+    def coords(self):
+        return (self.x, self.y)
+
+    def create_geometry(self):
+        from django.contrib.gis.geos import Point
+        return Point(self.x, self.y)
+
+    def __eq__(self, other):
+        if isinstance(other, Coords):
+            return self.coords == other.coords
+        return super(Coords, self).__eq__(other)
+
+    def __reduce__(self):
+        return (Coords, (self.x, self.y))
+
+    def __repr__(self):
+        return 'Coords(%r, %r)' %(self.x, self.y)
+
+
+class BoundingBox(LazyGeometry):
+    """
+    Envelope of two corner points, given in any order. The extent is
+    worked out in Python; the `Polygon` is built straight from it.
+    """
+    __slots__ = ('extent',)
+
+    def __init__(self, first, second):
+        super(BoundingBox, self).__init__()
+        self.extent = get_extent(first.coords, second.coords)
+
+    def create_geometry(self):
+        from django.contrib.gis.geos import Polygon
+        xmin, ymin, xmax, ymax = self.extent
+        # Same ring, vertex for vertex, as the GEOS envelope of the corners
+        return Polygon(((xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax), (xmin, ymin)))
+
+    def __reduce__(self):
+        xmin, ymin, xmax, ymax = self.extent
+        return (BoundingBox, (Coords(xmin, ymin), Coords(xmax, ymax)))
+
+    def __repr__(self):
+        return 'BoundingBox(%r, %r, %r, %r)' %self.extent
+
+
+class Circle(tuple):
+    """
+    `(center, distance)` pair whose center is built lazily.
+    """
+    __slots__ = ()
+
+    def __new__(cls, center, distance):
+        return super(Circle, cls).__new__(cls, (center, distance))
+
+    def resolve(self):
+        return (self[0].resolve(), self[1])
+
+    @property
+    def extent(self):
+        """
+        `(xmin, ymin, xmax, ymax)` in degrees of a box covering the circle.
+        """
+        center, distance = self
+        return get_circle_extent(center.x, center.y, distance.m)
+
+    def __reduce__(self):
+        return (Circle, tuple(self))
+
+
+def get_extent(first, second):
+    """
+    `(xmin, ymin, xmax, ymax)` of two `(x, y)` corners.
+    """
+    (x0, y0), (x1, y1) = first, second
+    return (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+
+def get_circle_extent(x, y, meters):
+    """
+    Extent of a box that contains every point within `meters` of the
+    longitude/latitude `(x, y)`. It errs on the large side: a degree of
+    latitude is taken at its shortest and the longitude span is taken at
+    the latitude farthest from the equator. Boxes reaching a pole or the
+    antimeridian span every longitude.
+    """
+    dy = meters / METERS_PER_DEGREE_LATITUDE
+    ymin, ymax = max(y - dy, -90.0), min(y + dy, 90.0)
+    widest = max(abs(ymin), abs(ymax))
+    if widest < 90:
+        dx = meters / (METERS_PER_DEGREE_LONGITUDE * math.cos(math.radians(widest)))
+        if x - dx >= -180 and x + dx <= 180:
+            return (x - dx, ymin, x + dx, ymax)
+    return (-180.0, ymin, 180.0, ymax)
+
+
+def resolve(value):
+    """
+    Build the geometry of a lazy value; other values are returned as is.
+    """
+    if isinstance(value, (LazyGeometry, Circle)):
+        return value.resolve()
+    return value
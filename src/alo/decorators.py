@@ -1,4 +1,4 @@
-from django.http import HttpRequest
+from django.http import HttpRequest, HttpResponse
 try:
     from django.http import JsonResponse
     native_json_response = True
@@ -7,52 +7,185 @@ except ImportError:
     native_json_response = False
 from django.shortcuts import get_object_or_404
 from django.forms import ModelForm
+from django.utils.translation import get_language
+from collections import OrderedDict
 from functools import wraps
+from .mixins import get_error_data
+from .instrumentation import timed
+import threading
+import copy
+
+try:
+    from asyncio import iscoroutinefunction
+except ImportError:
+    iscoroutinefunction = lambda func: False
+
+
+class LRUCache(object):
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                return None
+            self.data[key] = value
+            return value
+    
+    def set(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+
+def copy_form(form):
+    """
+    Shallow copy of a validated form whose data containers can be changed
+    without affecting the memoized original.
+    """
+    clone = copy.copy(form)
+    clone.cleaned_data = dict(form.cleaned_data)
+    clone._errors = copy.copy(form._errors)
+    clone._validated_data = dict(form._validated_data)
+    clone._alternatives = dict(form._alternatives)
+    if hasattr(form, '_parameters'):
+        clone._parameters = form._parameters.clone(clone)
+    return clone
+
+
+def can_memoize(form_class):
+    """
+    Whether validated forms of `form_class` can be reused by `memoize`.
+    Not for model forms, whose copies would share the `instance` that
+    `save()` writes to, nor for forms with callable defaults, which may
+    give a different value on each request.
+    """
+    if issubclass(form_class, ModelForm):
+        return False
+    return not getattr(getattr(form_class, '_meta', None), 'callable_defaults', ())
 
 
 class validate(object):
-    def __init__(self, form_class, add_instance_using='pk'):#, extra=None):
+    def __init__(self, form_class, add_instance_using='pk', memoize=None,
+                 dumps=None, clean_in_thread=None):#, extra=None):
         self.form_class = form_class
+        self.clean_in_thread = clean_in_thread
         self.add_instance_using = add_instance_using
+        self.memo = LRUCache(memoize) if memoize and can_memoize(form_class) else None
+        self.dumps = dumps
+        if issubclass(form_class, ModelForm):
+            self.model = form_class._meta.model
+        else:
+            self.model = None
         # self.extra = extra
+    
+    def get_request(self, args, position):
+        """
+        Find the `HttpRequest` in the view arguments. Its index is kept in
+        `position` so that later calls only check that one argument.
+        """
+        if position and len(args) > position[0]:
+            request = args[position[0]]
+            if isinstance(request, HttpRequest):
+                return request
+        for index,each in enumerate(args):
+            if isinstance(each, HttpRequest):
+                position[:] = [index]
+                return each
+        return args[0]
+    
+    def get_memo_key(self, request, kwargs):
+        """
+        Key of a request whose validation can be reused, or `None` if it
+        is not a GET or HEAD request, uploads files or the form is bound
+        to a model instance.
+        """
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        if request.FILES or kwargs.get(self.add_instance_using) != None:
+            return None
+        data = request.GET if request.method=='GET' else request.POST
+        return (request.method, get_language(), tuple(sorted(
+            (key, tuple(values)) for key,values in data.lists())))
+    
+    def get_instance_pk(self, kwargs):
+        if self.model is not None and kwargs:
+            return kwargs.get(self.add_instance_using, None)
+    
+    def get_form_kwargs(self, request):
+        data = request.GET if request.method=='GET' else request.POST
+        form_kwargs = {'data': data}
+        if not hasattr(request, "FILES"): 
+            form_kwargs['files'] = request.FILES
+        # if self.extra != None:
+        #     form_kwargs.update(self.extra(request))
+        return form_kwargs
+    
+    def get_form(self, request, kwargs):
+        form_kwargs = self.get_form_kwargs(request)
+        value = self.get_instance_pk(kwargs)
+        if value != None:
+            form_kwargs['instance'] = self.get_instance(value)
+        return self.form_class(**form_kwargs)
+    
+    @timed('get_instance', 'form_class')
+    def get_instance(self, pk):
+        return get_object_or_404(self.model, pk=pk)
+    
+    def error_response(self, form):
+        if self.dumps is not None:
+            content = self.dumps({'Errors': get_error_data(form.errors)})
+            return HttpResponse(content, status=400, content_type='application/json')
+        content = {'Errors': form.errors}
+        if native_json_response:
+            return JsonResponse(content, status=400, safe=False)
+        else:
+            return JsonResponse(content, status=400)
+    
+    def copy_response(self, response):
+        return HttpResponse(response.content, status=response.status_code,
+            content_type=response['Content-Type'])
+    
+    def validate(self, view, request, args, kwargs):
+        request.form = self.get_form(request, kwargs)
+        if request.form.is_valid():
+            return view(*args, **kwargs)
+        return self.error_response(request.form)
+    
+    def memoized_validate(self, view, request, args, kwargs):
+        key = self.get_memo_key(request, kwargs)
+        if key is None:
+            return self.validate(view, request, args, kwargs)
+        memoized = self.memo.get(key)
+        if memoized is None:
+            form = self.get_form(request, kwargs)
+            response = None if form.is_valid() else self.error_response(form)
+            self.memo.set(key, (form, response))
+        else:
+            form, response = memoized
+            if response is not None:
+                response = self.copy_response(response)
+        request.form = copy_form(form)
+        if response is None:
+            return view(*args, **kwargs)
+        return response
         
     def __call__(self, view):
+        if iscoroutinefunction(view):
+            from .async_views import validate_async
+            return validate_async(self, view)
+        
+        run = self.validate if self.memo is None else self.memoized_validate
+        position = []
         
         @wraps(view)
         def wrapper(*args, **kwargs):
-            
-            def get_form_kwargs(request):
-                data = request.GET if request.method=='GET' else request.POST
-                form_kwargs = {'data': data}
-                if not hasattr(request, "FILES"): 
-                    form_kwargs['files'] = request.FILES
-                if issubclass(self.form_class, ModelForm) and kwargs:
-                    value = kwargs.get(self.add_instance_using, None)
-                    if value != None:
-                        model = self.form_class.Meta.model
-                        instance = get_object_or_404(model, pk=value)
-                        form_kwargs['instance'] = instance    
-                # if self.extra != None:
-                #     form_kwargs.update(self.extra(request))
-                return form_kwargs
-            
-            def error_response(form):
-                content = {'Errors': form.errors}
-                if native_json_response:
-                    return JsonResponse(content, status=400, safe=False)
-                else:
-                    return JsonResponse(content, status=400)
-            
-            def validate(request):
-                request.form = self.form_class(**get_form_kwargs(each))
-                if request.form.is_valid():
-                    return view(*args, **kwargs)
-                return error_response(request.form)
-                
-            for each in args:
-                if isinstance(each, HttpRequest):
-                    return validate( each )
-            return validate( args[0] )        
+            return run(view, self.get_request(args, position), args, kwargs)
         
         return wrapper
-        
\ No newline at end of file
@@ -1,9 +1,23 @@
 from django.contrib.gis.forms import *
-from django.contrib.gis.geos import MultiPoint, Point
+from django.contrib.gis.geos import GEOSGeometry, Point, Polygon
 from django.contrib.gis.measure import D
-from django.core.exceptions import ValidationError
-from django.utils.translation import ugettext as _
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from .coords import Coords, BoundingBox, Circle, get_extent, get_circle_extent
 import math
+import struct
+
+try:
+    from django.utils.translation import ugettext as _
+except ImportError:
+    from django.utils.translation import gettext as _
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    from django.utils.six import memoryview
+except ImportError:
+    pass
 
 
 class CoordsField(CharField):
@@ -32,9 +46,9 @@ class CoordsField(CharField):
                 raise ValidationError(self.error_messages['invalid'])
             elif self.latitude_first:
                 if in_range(y, x):
-                    return Point(y, x)
+                    return Coords(y, x)
             elif in_range(x, y):
-                return Point(x, y)
+                return Coords(x, y)
             raise ValidationError(self.error_messages['out_of_range'])
             
 
@@ -46,12 +60,14 @@ class BoundingBoxWidget(MultiWidget):
     def decompress(self, value):
         if value is None:
             return [None, None]
-        return [Point(*each) for each in value[0]]
+        xmin, ymin, xmax, ymax = getattr(value, 'extent', value)
+        return [Point(xmin, ymin), Point(xmax, ymax)]
 
 
 class BoundingBoxField(MultiValueField):
-    def __init__(self, latitude_first=False, **kwargs):
+    def __init__(self, latitude_first=False, as_extent=False, **kwargs):
         self.latitude_first = latitude_first
+        self.as_extent = as_extent
         fields = (
             CoordsField(latitude_first=latitude_first),
             CoordsField(latitude_first=latitude_first),
@@ -61,17 +77,165 @@ class BoundingBoxField(MultiValueField):
         
     def compress(self, data_list):
         if len(data_list)==2:
-            return MultiPoint(*data_list).envelope
+            if self.as_extent:
+                return get_extent(*[each.coords for each in data_list])
+            return BoundingBox(*data_list)
         return None
 
 
 class CircleField(CoordsField):
-    def __init__(self, distance=5, unit='km', **kwargs):
+    def __init__(self, distance=5, unit='km', prefilter=None, **kwargs):
         self.distance = D(**{unit: distance})
+        self.prefilter = prefilter
         super(CircleField, self).__init__(**kwargs)
         
+    def get_lookups(self, lookup):
+        """
+        The `multifield_lookups` callable used when `prefilter` is set.
+        """
+        comparison = 'distance_lte'
+        if '__' in lookup:
+            path, suffix = lookup.rsplit('__', 1)
+            if suffix in ('distance_lt', 'distance_lte'):
+                lookup, comparison = path, suffix
+            elif suffix in ('distance_gt', 'distance_gte', 'dwithin'):
+                raise ImproperlyConfigured(
+                    "A prefilter can only narrow down 'distance_lt' and "
+                    "'distance_lte' lookups, not %r." %lookup)
+        return distance_lookups(lookup, prefilter=self.prefilter, comparison=comparison)
+        
     def to_python(self, value):
         if not value:
             return None
         point = super(CircleField, self).to_python(value)
-        return (point, self.distance)
+        return Circle(point, self.distance)
+
+
+def distance_lookups(lookup, prefilter='bboverlaps', unit='km', comparison='distance_lte'):
+    """
+    Build a `multifield_lookups` callable that filters `lookup` by distance
+    to a point. It takes either a `CircleField` value or a point and a
+    radius (a `Distance`, or a number in `unit`), and returns the exact
+    `comparison` lookup (`distance_lte` or `distance_lt`) plus a cheaper
+    one the database can answer from its spatial index first:
+    
+    - `'bboverlaps'`: `<lookup>__bboverlaps` with the box around the circle
+    - `'dwithin'`: `<lookup>__dwithin` with a radius in degrees that covers
+      that box, for geometry columns in longitude/latitude
+    """
+    if prefilter not in ('bboverlaps', 'dwithin'):
+        raise ValueError("prefilter must be 'bboverlaps' or 'dwithin', not %r" %prefilter)
+    if comparison not in ('distance_lt', 'distance_lte'):
+        raise ValueError("comparison must be 'distance_lt' or 'distance_lte', not %r" %comparison)
+    
+    def lookups(*values):
+        if len(values) == 1:
+            values = values[0]
+        point, distance = values
+        if not isinstance(distance, D):
+            distance = D(**{unit: distance})
+        xmin, ymin, xmax, ymax = get_circle_extent(point.x, point.y, distance.m)
+        if prefilter == 'bboverlaps':
+            value = Polygon.from_bbox((xmin, ymin, xmax, ymax))
+        else:
+            value = (point, math.hypot(xmax - point.x, ymax - point.y))
+        return {
+            '%s__%s' %(lookup, prefilter): value,
+            '%s__%s' %(lookup, comparison): (point, distance),
+        }
+    return lookups
+
+
+class MultiCoordsField(CharField):
+    """
+    Many coordinates in a single value, e.g. `'<lng>,<lat>;<lng>,<lat>'`,
+    converted to a `MultiPoint` or, with `geometry='linestring'`, to a
+    `LineString`. All pairs are parsed and range-checked in one pass (with
+    NumPy when available) and the geometry is read from a WKB buffer
+    instead of being built one `Point` at a time.
+    """
+    WKB_TYPES = {'multipoint': 4, 'linestring': 2}
+    
+    def __init__(self, latitude_first=False, geometry='multipoint', 
+                 min_points=1, max_points=None, **kwargs):
+        if geometry not in self.WKB_TYPES:
+            raise ValueError("geometry must be 'multipoint' or 'linestring'")
+        self.latitude_first = latitude_first
+        self.geometry = geometry
+        self.min_points = max(min_points, 2 if geometry == 'linestring' else 1)
+        self.max_points = max_points
+        kwargs['error_messages'] = {
+            'invalid': _('Enter valid coordinate numbers.'),
+            'no_pair': _('Enter pairs of numbers, separated by a comma.'),
+            'out_of_range': _('Enter coordinates within range'),
+            'min_points': _('Enter at least %(size)s coordinates.'),
+            'max_points': _('Enter at most %(size)s coordinates.'),
+        }
+        super(MultiCoordsField, self).__init__(**kwargs)
+    
+    def to_python(self, value):
+        if not value:
+            return None
+        values = []
+        for pair in value.split(';'):
+            pair = pair.split(',')
+            if len(pair) != 2:
+                raise ValidationError(self.error_messages['no_pair'])
+            values.extend(pair)
+        size = len(values) // 2
+        if size < self.min_points:
+            raise ValidationError(
+                self.error_messages['min_points'] %{'size': self.min_points})
+        if self.max_points and size > self.max_points:
+            raise ValidationError(
+                self.error_messages['max_points'] %{'size': self.max_points})
+        if numpy is not None:
+            buffer = self.parse_array(values)
+        else:
+            buffer = self.parse_list(values)
+        wkb_type = self.WKB_TYPES[self.geometry]
+        header = struct.pack('<BII', 1, wkb_type, size)
+        return GEOSGeometry(memoryview(header + buffer))
+    
+    def parse_array(self, values):
+        try:
+            coords = numpy.array(values, dtype=float).reshape(-1, 2)
+        except ValueError:
+            raise ValidationError(self.error_messages['invalid'])
+        if numpy.isnan(coords).any():
+            raise ValidationError(self.error_messages['invalid'])
+        if self.latitude_first:
+            coords = coords[:, ::-1]
+        lon, lat = coords[:, 0], coords[:, 1]
+        if not (numpy.all((-180 < lon) & (lon < 180)) and 
+                numpy.all((-90 < lat) & (lat < 90))):
+            raise ValidationError(self.error_messages['out_of_range'])
+        if self.geometry == 'linestring':
+            return coords.astype('<f8').tobytes()
+        points = numpy.empty(len(coords), dtype=[
+            ('order', 'u1'), ('type', '<u4'), ('x', '<f8'), ('y', '<f8')])
+        points['order'] = 1
+        points['type'] = 1
+        points['x'] = lon
+        points['y'] = lat
+        return points.tobytes()
+    
+    def parse_list(self, values):
+        try:
+            coords = [float(each) for each in values]
+        except ValueError:
+            raise ValidationError(self.error_messages['invalid'])
+        if any(math.isnan(each) for each in coords):
+            raise ValidationError(self.error_messages['invalid'])
+        if self.latitude_first:
+            coords[0::2], coords[1::2] = coords[1::2], coords[0::2]
+        if not (all(-180 < each < 180 for each in coords[0::2]) and 
+                all(-90 < each < 90 for each in coords[1::2])):
+            raise ValidationError(self.error_messages['out_of_range'])
+        size = len(coords) // 2
+        if self.geometry == 'linestring':
+            return struct.pack('<%dd' %len(coords), *coords)
+        points = []
+        for i in range(size):
+            points.extend( (1, 1, coords[2*i], coords[2*i+1]) )
+        return struct.pack('<' + 'BIdd' * size, *points)
@@ -1,31 +1,117 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.forms import *
+import sys
+
+
+def __getattr__(name):
+    """
+    Load `CoordsField`, `BoundingBoxField`, `CircleField` and the rest of
+    `django.contrib.gis.forms` on first access, so that GEOS is only looked
+    up by code that uses them.
+    """
+    if name.startswith('__'):
+        raise AttributeError(name)
+    try:
+        from . import fields
+        value = getattr(fields, name)
+    except (ImportError, ImproperlyConfigured, AttributeError) as e:
+        raise AttributeError(
+            "module %r has no attribute %r (%s)" %(__name__, name, e))
+    globals()[name] = value
+    return value
+
+
+if sys.version_info < (3, 7):
+    # No module-level __getattr__ before Python 3.7
+    try:
+        from .fields import *
+    except (ImportError, ImproperlyConfigured):
+        sys.stdout.write("Warning: Could not find the GEOS library.\n")
+
+from django.forms.forms import DeclarativeFieldsMetaclass
+from django.forms.models import ModelFormMetaclass
+from .mixins import QueryFormMixin, shared_reads
+from .instrumentation import RECORDERS, incr, timed
+from .operators import AND, OR
+import copy
+
 try:
-    from .fields import *
+    from django.utils.six import with_metaclass
 except ImportError:
-    import sys
-    sys.stdout.write("Warning: Could not find the GEOS library.\n")
-    from django.forms import *
-    
-from .mixins import QueryFormMixin
-from .operators import AND, OR
+    def with_metaclass(meta, *bases):
+        return meta('NewBase', bases, {})
+
 
+class QueryFormMetaclass(DeclarativeFieldsMetaclass):
+    def __new__(mcs, name, bases, attrs):
+        new_class = super(QueryFormMetaclass, mcs).__new__(mcs, name, bases, attrs)
+        new_class.compile_meta()
+        return new_class
 
-class QueryModelForm(ModelForm, QueryFormMixin):
+
+class QueryModelFormMetaclass(ModelFormMetaclass):
+    def __new__(mcs, name, bases, attrs):
+        new_class = super(QueryModelFormMetaclass, mcs).__new__(mcs, name, bases, attrs)
+        new_class.compile_meta()
+        return new_class
+
+
+class QueryModelForm(with_metaclass(QueryModelFormMetaclass, ModelForm, QueryFormMixin)):
     def __init__(self, *args, **kwargs):
         super(QueryModelForm, self).__init__(*args, **kwargs)
-        self.set_meta()
-        self.reset_required_fields()
+        self.end_shared_reads()
+        self.set_defaults()
+        if RECORDERS:
+            incr(self.__class__, 'forms_built')
+    
+    def __getitem__(self, name):
+        bound_field = self.get_shared_bound_field(name)
+        if bound_field is None:
+            return super(QueryModelForm, self).__getitem__(name)
+        return bound_field
+    
+    def order_fields(self, field_order):
+        fields = self.fields
+        super(QueryModelForm, self).order_fields(field_order)
+        self.keep_copy_on_write(fields)
                       
+    def rebind(self, data):
+        super(QueryModelForm, self).rebind(data)
+        if not hasattr(self, '_unbound_instance'):
+            self._unbound_instance = self.instance
+        self.instance = copy.copy(self._unbound_instance)
+                      
+    @timed('full_clean')
     def full_clean(self):
         super(QueryModelForm, self).full_clean()
         self.clean_extralogic()
+    
+    def _post_clean(self):
+        # Model validation reads each field by name, but never changes it
+        with shared_reads(self.fields):
+            super(QueryModelForm, self)._post_clean()
 
 
-class QueryForm(Form, QueryFormMixin):    
+class QueryForm(with_metaclass(QueryFormMetaclass, Form, QueryFormMixin)):
     def __init__(self, *args, **kwargs):
         super(QueryForm, self).__init__(*args, **kwargs)
-        self.set_meta()
-        self.reset_required_fields()
+        self.end_shared_reads()
+        self.set_defaults()
+        if RECORDERS:
+            incr(self.__class__, 'forms_built')
+    
+    def __getitem__(self, name):
+        bound_field = self.get_shared_bound_field(name)
+        if bound_field is None:
+            return super(QueryForm, self).__getitem__(name)
+        return bound_field
+    
+    def order_fields(self, field_order):
+        fields = self.fields
+        super(QueryForm, self).order_fields(field_order)
+        self.keep_copy_on_write(fields)
     
+    @timed('full_clean')
     def full_clean(self):
         super(QueryForm, self).full_clean()
         self.clean_extralogic()
@@ -0,0 +1,168 @@
+"""
+Optional timings and counters of the validation hot path, per form class.
+
+Nothing is recorded until a recorder is added:
+
+    from alo import instrumentation
+    instrumentation.add_recorder(instrumentation.StatsdRecorder())
+
+Recorders receive
+
+- `timing(form_class, phase, seconds)` for the `full_clean`,
+  `clean_extralogic`, `set_validated_data` and `get_parameters` phases of
+  a form, and for `get_instance`, the instance lookup of the `validate`
+  decorator. Phases nest: `full_clean` includes `clean_extralogic`, which
+  includes `set_validated_data`.
+- `incr(form_class, metric, value, rule)` for the `forms_built`,
+  `rules_evaluated` and `rule_failures` counters. `rule` is the text of
+  the failing `extralogic` rule, and `None` for the other counters.
+"""
+from collections import defaultdict
+from functools import wraps
+from timeit import default_timer
+import re
+import socket
+import threading
+
+
+RECORDERS = []
+
+
+def add_recorder(recorder):
+    if recorder not in RECORDERS:
+        RECORDERS.append(recorder)
+    return recorder
+
+
+def remove_recorder(recorder):
+    if recorder in RECORDERS:
+        RECORDERS.remove(recorder)
+
+
+def timing(form_class, phase, seconds):
+    for each in RECORDERS:
+        each.timing(form_class, phase, seconds)
+
+
+def incr(form_class, metric, value=1, rule=None):
+    for each in RECORDERS:
+        each.incr(form_class, metric, value, rule)
+
+
+def timed(phase, form_class_attr=None):
+    """
+    Time a method as `phase` of `self.__class__`, or of the form class in
+    `self.<form_class_attr>`. With no recorder the cost is one extra call.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not RECORDERS:
+                return method(self, *args, **kwargs)
+            start = default_timer()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                form_class = getattr(self, form_class_attr) if form_class_attr else self.__class__
+                timing(form_class, phase, default_timer() - start)
+        return wrapper
+    return decorator
+
+
+def get_label(form_class):
+    return '%s.%s' %(form_class.__module__, form_class.__name__)
+
+
+class Recorder(object):
+    """
+    Base class of the recorders; both methods do nothing.
+    """
+    def timing(self, form_class, phase, seconds):
+        pass
+
+    def incr(self, form_class, metric, value, rule):
+        pass
+
+
+class MemoryRecorder(Recorder):
+    """
+    Aggregate in memory: the count, total and maximum of each phase's
+    timings and the sum of each counter. `as_prometheus()` renders them
+    in the Prometheus text format.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timings = defaultdict(lambda: [0, 0.0, 0.0])
+            self.counters = defaultdict(int)
+
+    def timing(self, form_class, phase, seconds):
+        with self.lock:
+            stats = self.timings[(get_label(form_class), phase)]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def incr(self, form_class, metric, value, rule):
+        with self.lock:
+            self.counters[(get_label(form_class), metric, rule)] += value
+
+    def as_prometheus(self):
+        with self.lock:
+            timings = sorted(self.timings.items())
+            counters = sorted(self.counters.items(), key=repr)
+        lines = []
+        if timings:
+            lines.append('# TYPE alo_phase_seconds summary')
+        for (label,phase),(count,total,maximum) in timings:
+            labels = 'form="%s",phase="%s"' %(label, phase)
+            lines.append('alo_phase_seconds_count{%s} %d' %(labels, count))
+            lines.append('alo_phase_seconds_sum{%s} %r' %(labels, total))
+        metrics = []
+        for (label,metric,rule),value in counters:
+            if metric not in metrics:
+                metrics.append(metric)
+                lines.append('# TYPE alo_%s_total counter' %metric)
+            labels = 'form="%s"' %label
+            if rule is not None:
+                labels += ',rule="%s"' %escape_label(rule)
+            lines.append('alo_%s_total{%s} %d' %(metric, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class StatsdRecorder(Recorder):
+    """
+    Send every timing and counter to a statsd server over UDP, e.g.
+    `alo.app_forms_BookForm.full_clean:0.412|ms`. Failing rules are sent
+    as `alo.<form>.rule_failures.<rule>:1|c`.
+    """
+    def __init__(self, host='localhost', port=8125, prefix='alo'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, line):
+        try:
+            self.socket.sendto(line.encode('utf-8'), self.address)
+        except socket.error:
+            pass
+
+    def get_name(self, *parts):
+        return '.'.join([self.prefix] + [re.sub(r'[^\w-]+', '_', each) for each in parts])
+
+    def timing(self, form_class, phase, seconds):
+        name = self.get_name(get_label(form_class), phase)
+        self.send('%s:%.3f|ms' %(name, seconds * 1000))
+
+    def incr(self, form_class, metric, value, rule):
+        parts = [get_label(form_class), metric]
+        if rule is not None:
+            parts.append(rule)
+        self.send('%s:%d|c' %(self.get_name(*parts), value))
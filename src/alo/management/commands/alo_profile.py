@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from alo.profiling import load_samples, summarize
+
+
+def ms(value):
+    return '-' if value is None else '%.2f' %(value * 1000)
+
+
+class Command(BaseCommand):
+    help = 'Report the validation cost sampled by alo.profiling.ProfilingMiddleware.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', dest='path',
+            help='samples file (defaults to the ALO_PROFILE_FILE setting)')
+        parser.add_argument('--top', type=int, default=10,
+            help='number of form classes and rules listed')
+        parser.add_argument('--clear', action='store_true',
+            help='empty the samples file after the report')
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(settings, 'ALO_PROFILE_FILE', None)
+        if not path:
+            raise CommandError('Give --file or set ALO_PROFILE_FILE.')
+        try:
+            samples = load_samples(path)
+        except (IOError, OSError) as e:
+            raise CommandError('Could not read %s: %s' %(path, e))
+        report = summarize(samples, top=options['top'])
+        write = self.stdout.write
+
+        write('%d sampled requests (times in ms)' %len(samples))
+        write('%-40s %7s %8s %8s %8s %8s %8s %8s' %(
+            'URL name', 'count', 'alo p50', 'p95', 'p99', 'db p50', 'p95', 'p99'))
+        for name,count,alo,query in report['urls']:
+            write('%-40s %7d %8s %8s %8s %8s %8s %8s' %(
+                (name, count) + tuple(ms(each) for each in alo + query)))
+
+        write('\nSlowest form classes')
+        write('%-60s %7s %8s %8s %8s' %('form', 'count', 'p50', 'p95', 'p99'))
+        for form,count,alo in report['forms']:
+            write('%-60s %7d %8s %8s %8s' %((form, count) + tuple(ms(each) for each in alo)))
+
+        write('\nMost failed extralogic rules')
+        write('%-40s %-40s %8s' %('form', 'rule', 'failures'))
+        for form,rule,count in report['rules']:
+            write('%-40s %-40s %8d' %(form, rule, count))
+
+        if options['clear']:
+            open(path, 'w').close()
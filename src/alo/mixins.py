@@ -1,140 +1,517 @@
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
 from django.core.exceptions import ValidationError
+from django.db.models import Q
 from django import forms
 from .operators import BaseOperator, AND, OR
+from .coords import resolve
+from .parameters import Parameters
+from .instrumentation import RECORDERS, incr, timed
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import reduce
+from itertools import islice
+from operator import and_, or_
+import copy
+import multiprocessing
+import time
 
+try:
+    from django.utils.encoding import force_text
+except ImportError:
+    from django.utils.encoding import force_str as force_text
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+def get_error_data(errors):
+    """
+    `form.errors` as plain lists of strings, which any JSON encoder handles
+    and which can be pickled.
+    """
+    return dict(
+        (name, [force_text(message) for message in messages])
+        for name,messages in errors.items()
+    )
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def validate_chunk(form_class, chunk):
+    """
+    Validate a chunk of payloads. Module-level so that executors in other
+    processes can run it; `form_class` is pickled by reference.
+    """
+    return [
+        (parameters, get_error_data(errors))
+        for parameters,errors in form_class.validate_many(chunk)
+    ]
+
+
+class CopyOnWriteFields(OrderedDict):
+    """
+    The `fields` of a form whose `Meta.copy_fields_on_write` is set. It
+    starts out with the class's fields and deep-copies one only when it is
+    read by name, e.g. `form.fields['book'].queryset = ...`, or replaced.
+    Iterating gives the fields as they are, shared with the class until
+    then, so they must be treated as read-only. Fields holding a
+    `queryset` are copied up front, since `ModelForm` narrows it in place.
+    Fields read by name inside `shared_reads()` are not copied either.
+    """
+    def __init__(self, fields=(), shared_reads=0, copied=None):
+        self.copied = set()
+        super(CopyOnWriteFields, self).__init__(fields)
+        self.shared_reads = shared_reads
+        if copied is not None:
+            self.copied = set(copied)
+            return
+        self.copied.clear()
+        for name,field in self.items():
+            if hasattr(field, 'queryset'):
+                self[name] = copy.deepcopy(field)
+
+    def __getitem__(self, name):
+        field = dict.__getitem__(self, name)
+        if name not in self.copied and not self.shared_reads:
+            field = copy.deepcopy(field)
+            self[name] = field
+        return field
+
+    def __setitem__(self, name, field, *args, **kwargs):
+        super(CopyOnWriteFields, self).__setitem__(name, field, *args, **kwargs)
+        self.copied.add(name)
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def items(self):
+        return [(name, dict.__getitem__(self, name)) for name in self]
+
+    def values(self):
+        return [dict.__getitem__(self, name) for name in self]
+
+    iteritems = lambda self: iter(self.items())
+    itervalues = lambda self: iter(self.values())
+
+    def reordered(self, fields):
+        """
+        `fields`, the same fields in another order, still copy-on-write.
+        """
+        return CopyOnWriteFields(fields, self.shared_reads, self.copied)
+
+    def get_bound_field(self, form, name):
+        field = dict.__getitem__(self, name)
+        if hasattr(field, 'get_bound_field'):
+            return field.get_bound_field(form, name)
+        return forms.forms.BoundField(form, field, name)
+
+
+class SharedFields(OrderedDict):
+    """
+    `base_fields` of a form class with `Meta.copy_fields_on_write`. The
+    deep copy `Form.__init__` makes of it is a `CopyOnWriteFields`, whose
+    reads are shared until the form's `__init__` is done (in Django 1.8
+    `ModelForm.__init__` reads every field by name).
+    """
+    def __deepcopy__(self, memo):
+        return CopyOnWriteFields(self, shared_reads=1)
+
+
+@contextmanager
+def shared_reads(fields):
+    """
+    Read `CopyOnWriteFields` by name without copying them, around code
+    known not to change them, such as Django's model validation.
+    """
+    if not isinstance(fields, CopyOnWriteFields):
+        yield
+        return
+    fields.shared_reads += 1
+    try:
+        yield
+    finally:
+        fields.shared_reads -= 1
+
+
+class QueryFormOptions(object):
+    """
+    Class-level options compiled from the form's `Meta` and `base_fields`.
+    Shared by every instance of the form class and never mutated after
+    the class is created, except for `memoized_defaults`, the cache of
+    the callable defaults listed in `Meta.memoize_defaults`.
+    """
+    def __init__(self, meta, fields):
+        required = getattr(meta, 'required', None)
+        self.required = frozenset(required) if required is not None else None
+        self.ignore = frozenset(getattr(meta, 'ignore', []))
+        self.no_defaults = getattr(meta, 'no_defaults', False)
+        self.copy_fields_on_write = getattr(meta, 'copy_fields_on_write', False)
+        self.set_positions(fields)
+        self.set_lookups_and_defaults(meta, fields)
+        self.set_multifield_lookups(meta, fields)
+        self.set_extralogic(meta, fields)
+
+    def set_positions(self, fields):
+        self.positions = dict(
+            (name, 1 << i) for i,name in enumerate(fields)
+        )
+        self.field_bits = tuple(
+            (name, 1 << i) for i,name in enumerate(fields)
+        )
+
+    def set_lookups_and_defaults(self, meta, fields):
+        lookups = getattr(meta, 'lookups', {})
+        self.lookups = {}
+        self.defaults = {}
+        self.callable_defaults = ()
+        self.callable_defaults_mask = 0
+        for name,field in fields.items():
+            self.lookups[name] = lookups.get(name, name)
+            if not self.no_defaults:
+                self.defaults[name] = field.initial
+                if callable(field.initial):
+                    self.callable_defaults += (name,)
+                    self.callable_defaults_mask |= self.positions[name]
+        # Seconds for which the value of a callable default is reused
+        self.memoize_defaults = dict(getattr(meta, 'memoize_defaults', {}))
+        self.memoized_defaults = {}
+
+    def set_multifield_lookups(self, meta, fields):
+        self.multifield_lookups = dict(getattr(meta, 'multifield_lookups', {}))
+        for name,field in fields.items():
+            # e.g. CircleField(prefilter=...), which adds an index lookup
+            if getattr(field, 'prefilter', None) and name not in self.ignore:
+                self.multifield_lookups.setdefault(
+                    (name,), field.get_lookups(self.lookups[name]))
+        grouped = set()
+        for each in self.multifield_lookups:
+            grouped.update(each)
+        self.grouped_fields = frozenset(grouped)
+        # The fields behind each lookup `parameters` reads a single field for
+        self.lookup_fields = {}
+        for name,lookup in self.lookups.items():
+            if name not in self.ignore and name not in grouped:
+                self.lookup_fields.setdefault(lookup, ())
+                self.lookup_fields[lookup] += (name,)
+
+    def set_extralogic(self, meta, fields):
+        self.extralogic = tuple(
+            each.bind(fields) for each in getattr(meta, 'extralogic', [])
+        )
+        for each in self.extralogic:
+            each.compile(self.positions)
+        self.set_alternatives()
+
+    def set_alternatives(self):
+        """
+        Fields of `OR` rules that `as_q(alternatives=True)` combines with `|`.
+        A rule with an ignored field or a field grouped by
+        `multifield_lookups` has no `Q` for every operand, so it is left
+        out and only keeps the field it picked, as in `as_q()`.
+        """
+        excluded = self.ignore | self.grouped_fields
+        alternatives = []
+        for each in self.extralogic:
+            if isinstance(each, OR):
+                fieldnames = frozenset(each.iter_all_operands())
+                if not fieldnames & excluded:
+                    alternatives.append((each, fieldnames))
+        self.alternatives = tuple(alternatives)
 
-class ValidatedValue(object):
-    def __init__(self, value, is_default=False):
-        self.object = value
-        self.is_default = is_default
-    
-    def __cmp__(self, other):
-        if self.object < other:
-            return -1
-        elif self.object > other:
-            return 1
-        return 0
 
-        
 class QueryFormMixin(object):
-    
+
+    @classmethod
+    def compile_meta(cls):
+        """
+        Compile the `Meta` options once per form class. `ModelForm`
+        subclasses already own a `_meta`, so the options are set on it.
+        """
+        options = QueryFormOptions(getattr(cls, 'Meta', None), cls.base_fields)
+        if '_meta' in cls.__dict__:
+            cls._meta.__dict__.update(options.__dict__)
+        else:
+            cls._meta = options
+        cls.set_base_fields(options)
+
+    @classmethod
+    def set_base_fields(cls, options):
+        """
+        Apply `Meta.required` to `base_fields` once, so that instances
+        only need the copy of the fields `Form.__init__` makes. Fields
+        whose flag changes are copied first, as they may be shared with
+        other form classes.
+        """
+        base_fields = OrderedDict(cls.base_fields)
+        if options.required is not None:
+            for name,field in base_fields.items():
+                required = name in options.required
+                if field.required != required:
+                    field = base_fields[name] = copy.deepcopy(field)
+                    field.required = required
+        if options.copy_fields_on_write:
+            base_fields = SharedFields(base_fields)
+        cls.base_fields = base_fields
+
+    @classmethod
+    def validate_many(cls, iterable, **kwargs):
+        """
+        Validate many payloads with a single form instance, yielding a
+        `(parameters, errors)` pair for each. `parameters` is `None` when
+        the payload is not valid.
+        """
+        form = cls(**kwargs)
+        for data in iterable:
+            form.rebind(data)
+            if form.is_valid():
+                yield form.get_parameters(), {}
+            else:
+                yield None, form.errors
+
+    @classmethod
+    def validate_stream(cls, iterable, chunksize=100, executor=None, pending=None):
+        """
+        Like `validate_many` but consumes `iterable` in chunks, and errors
+        are plain lists of strings. With an `executor`, e.g. a
+        `ProcessPoolExecutor`, chunks are validated concurrently; at most
+        `pending` chunks are in flight and results keep the input order.
+        """
+        chunks = iter_chunks(iterable, chunksize)
+        if executor is None:
+            for chunk in chunks:
+                for result in validate_chunk(cls, chunk):
+                    yield result
+            return
+        if pending is None:
+            pending = 2 * multiprocessing.cpu_count()
+        futures = deque()
+        for chunk in chunks:
+            futures.append( executor.submit(validate_chunk, cls, chunk) )
+            if len(futures) >= pending:
+                for result in futures.popleft().result():
+                    yield result
+        while futures:
+            for result in futures.popleft().result():
+                yield result
+
+    def rebind(self, data):
+        """
+        Bind the form to new `data`, discarding the previous cleaning.
+        """
+        self.is_bound = True
+        self.data = data
+        self._errors = None
+        self._bound_fields_cache = {}
+        for attr in ('_parameters', 'changed_data'):
+            self.__dict__.pop(attr, None)
+        self.set_defaults()
+
     def reset_required_fields(self):
+        """
+        Apply `Meta.required` to `fields`. Forms already get it from
+        `base_fields`; this is for fields changed after construction.
+        """
         if self._meta.required != None:
-            for name,field in self.fields.iteritems():
-                field.required = name in self._meta.required
-    
-    def set_meta(self):                        
-        if not hasattr(self, '_meta'):
-            self._meta = type('Meta', (object,), {})()
-        if not hasattr(self, 'Meta'):
-            self.Meta = type('Meta', (object,), {})()
-        self._meta.required = getattr(self.Meta, 'required', None)
-        self._meta.ignore = getattr(self.Meta, 'ignore', [])
-        self.set_lookups_and_defaults()
-        self.set_multifield_lookups()
-        self.set_extralogic()
-            
-    def set_lookups_and_defaults(self):
-        self._meta.defaults = {}
-        self._meta.lookups = {}
-        self._meta.no_defaults = getattr(self.Meta, 'no_defaults', False)
-        for name,field in self.fields.iteritems():
-            if hasattr(self.Meta, 'lookups'):
-                self._meta.lookups[name] = self.Meta.lookups.get(name, name)
-            else:
-                self._meta.lookups[name] = name
-            if not self._meta.no_defaults:
-                if callable(field.initial):
-                    self._meta.defaults[name] = field.initial()
-                else:
-                    self._meta.defaults[name] = field.initial
-    
-    def set_multifield_lookups(self):
-        self._meta.multifield_lookups = {}
-        if hasattr(self.Meta, 'multifield_lookups'):
-            for fields,alias in self.Meta.multifield_lookups.iteritems():
-                self._meta.multifield_lookups[fields] = alias
-    
-    def set_extralogic(self):
-        def get_logic(operator):
-            args = []
-            for value in operator.operands:
-                if isinstance(value, (str, unicode)):
-                    self.fields[value].attrname = value
-                    args.append( self.fields[value] )
-                elif isinstance(value, BaseOperator):
-                    args.append( get_logic(value) )
-            return operator.create(*args, required=operator.required)
-            
-        self._meta.extralogic = []
-        if hasattr(self.Meta, 'extralogic'):
-            for each in self.Meta.extralogic:
-                self._meta.extralogic.append( get_logic(each) )
-    
+            for name,field in self.fields.items():
+                required = name in self._meta.required
+                if field.required != required:
+                    self.fields[name].required = required
+
+    def end_shared_reads(self):
+        """
+        Called at the end of `__init__`, see `SharedFields`.
+        """
+        if isinstance(self.fields, CopyOnWriteFields) and self.fields.shared_reads:
+            self.fields.shared_reads -= 1
+
+    def keep_copy_on_write(self, fields):
+        """
+        `order_fields()` rebuilds `fields` as a plain dict of the same
+        field instances; keep it copy-on-write, see `SharedFields`.
+        """
+        if isinstance(fields, CopyOnWriteFields) and \
+                not isinstance(self.fields, CopyOnWriteFields):
+            self.fields = fields.reordered(self.fields)
+
+    def get_shared_bound_field(self, name):
+        """
+        The bound field of `name` when `fields` is copy-on-write, built
+        without copying the field. `None` otherwise.
+        """
+        fields = self.fields
+        if not isinstance(fields, CopyOnWriteFields) or name not in fields:
+            return None
+        try:
+            return self._bound_fields_cache[name]
+        except KeyError:
+            bound_field = self._bound_fields_cache[name] = fields.get_bound_field(self, name)
+            return bound_field
+
+    def set_defaults(self):
+        # Callable defaults are only called by set_validated_data, for
+        # the fields left empty
+        self._defaults = self._meta.defaults
+
+    def get_default(self, fieldname):
+        """
+        Call the callable default of `fieldname`, or reuse its value for
+        the number of seconds given in `Meta.memoize_defaults`.
+        """
+        meta = self._meta
+        default = self._defaults[fieldname]
+        ttl = meta.memoize_defaults.get(fieldname)
+        if ttl is None:
+            return default()
+        now = clock()
+        memoized = meta.memoized_defaults.get(fieldname)
+        if memoized is not None and now < memoized[0]:
+            return memoized[1]
+        value = default()
+        meta.memoized_defaults[fieldname] = (now + ttl, value)
+        return value
+
     def get_validated_data(self):
-        return {k:v.object for k,v in self._validated_data.iteritems()}
+        return dict(self._validated_data)
     
+    @timed('set_validated_data')
     def set_validated_data(self):
-        self._validated_data = {}
-        for fieldname,lookup in self._meta.lookups.iteritems():
-            value = self.cleaned_data.get(fieldname)
+        """
+        Collect the non-empty cleaned values, falling back to the defaults,
+        in `_validated_data`. The positions of the collected fields are set
+        in the `_present` bitmask, and those that took their default in the
+        `_defaulted` bitmask.
+        """
+        self._validated_data = validated_data = {}
+        present = defaulted = 0
+        cleaned_data = self.cleaned_data
+        defaults = self._defaults
+        callable_defaults = self._meta.callable_defaults_mask
+        for fieldname,bit in self._meta.field_bits:
+            value = cleaned_data.get(fieldname)
             if value not in [None, '']:
-                value = ValidatedValue(value, is_default=False)
-                self._validated_data[fieldname] = value
+                validated_data[fieldname] = value
+                present |= bit
             else:
-                default_value = self._meta.defaults.get(fieldname)
+                if callable_defaults & bit:
+                    default_value = self.get_default(fieldname)
+                else:
+                    default_value = defaults.get(fieldname)
                 if default_value:
-                    value = ValidatedValue(default_value, is_default=True)
-                    self._validated_data[fieldname] = value 
+                    validated_data[fieldname] = default_value
+                    present |= bit
+                    defaulted |= bit
+        self._present = present
+        self._defaulted = defaulted
 
     @property
     def parameters(self):
+        """
+        The lookups for the validated data, as a read-only `Parameters`
+        mapping computed on access.
+        """
         if not hasattr(self, '_parameters'):
-            self._parameters = self.get_parameters()
+            self._parameters = Parameters(self)
         return self._parameters
         
+    @timed('get_parameters')
     def get_parameters(self):
-        meta = self._meta
-        items = self._validated_data.iteritems()
-        parameters = {
-            meta.lookups[k]:v.object for k,v in items if k not in meta.ignore
-        }
-        for fields,call in meta.multifield_lookups.iteritems():
-            values = []
-            for fieldname in fields:
-                value = self._validated_data.get(fieldname)
-                if value is not None:
-                    parameters.pop(meta.lookups.get(fieldname), None)
-                    values.append(value.object)
-            if len(values) == len(fields):
-                parameters.update(call(*values))
-        return parameters
+        return self.parameters.copy()
     
+    def as_q(self, alternatives=False):
+        """
+        Return `parameters` as a `Q` object. If `alternatives` is set, the
+        fields given for an `OR` rule are combined with `|` instead of
+        keeping only the first one.
+        """
+        if not alternatives:
+            return Q(*self.get_parameters().items())
+        lookups = self._meta.lookups
+        values = dict(self._alternatives)
+        values.update(self._validated_data)
+        parameters = self.get_parameters()
+        query = Q()
+        for operator,fieldnames in self._meta.alternatives:
+            for fieldname in fieldnames:
+                parameters.pop(lookups[fieldname], None)
+            query &= self.get_alternatives_q(operator, fieldnames, values)
+        return query & Q(*parameters.items())
+
+    def get_alternatives_q(self, operator, fieldnames, values):
+        children = []
+        for each in operator.operands:
+            if isinstance(each, BaseOperator):
+                children.append( self.get_alternatives_q(each, fieldnames, values) )
+            elif each in fieldnames and each in values:
+                children.append( Q((self._meta.lookups[each], resolve(values[each]))) )
+        children = [each for each in children if each]
+        if not children:
+            return Q()
+        return reduce(or_ if isinstance(operator, OR) else and_, children)
+
+    def apply(self, queryset, alternatives=False):
+        return queryset.filter(self.as_q(alternatives=alternatives))
+
+    def cached_queryset(self, queryset, timeout=DEFAULT_TIMEOUT, alternatives=False):
+        from .cache import cached_queryset
+        return cached_queryset(self, queryset, timeout=timeout, alternatives=alternatives)
+
     def add_validation_error(self, name, messages):
         try:
             self.add_error(name, messages)
         except AttributeError:
             self._errors[name] = messages
            
+    @timed('clean_extralogic')
     def clean_extralogic(self):
+        """
+        Evaluate the `extralogic` rules against the bitmask of present
+        fields. Defaults dropped by a failing rule and the fields an `OR`
+        rule did not pick are only cleared from the bitmask while the rules
+        run; `_validated_data` and `_alternatives` are updated once at the
+        end.
+        """
         self.set_validated_data()
+        positions = self._meta.positions
+        present = self._present
+        defaulted = self._defaulted
+        alternatives = 0
         for each in self._meta.extralogic:
             try:
-                result = each.is_valid(self._validated_data)
+                result = each.evaluate(present)
             except ValidationError as e:
-                for field in each.iter_all_operands():
-                    if field.attrname in self._validated_data:
-                        if self._validated_data[field.attrname].is_default:
-                            self._validated_data.pop(field.attrname)
+                if RECORDERS:
+                    incr(self.__class__, 'rule_failures', rule=str(each))
+                for fieldname,bit in each.all_operand_bits:
+                    if present & bit:
+                        if defaulted & bit:
+                            present &= ~bit
                         else:
-                            self.add_validation_error(field.attrname, e.messages)
+                            self.add_validation_error(fieldname, e.messages)
                             break
                     elif each.required:
-                        self.add_validation_error(field.attrname, e.messages)
+                        self.add_validation_error(fieldname, e.messages)
                         break
             else:
                 if isinstance(each, OR):
-                    for field in each.iter_all_operands():
-                        if field.attrname != result:
-                            self._validated_data.pop(field.attrname, None)
-                
+                    lost = present & each.all_mask & ~positions.get(result, 0)
+                    # Defaults were not given, so they are no alternative
+                    alternatives |= lost & ~defaulted
+                    present &= ~lost
+        self._alternatives = {}
+        removed = self._present & ~present
+        if removed:
+            validated_data = self._validated_data
+            for fieldname,bit in self._meta.field_bits:
+                if removed & bit:
+                    value = validated_data.pop(fieldname)
+                    if alternatives & bit:
+                        self._alternatives[fieldname] = value
+        self._present = present
+        if RECORDERS:
+            incr(self.__class__, 'rules_evaluated', len(self._meta.extralogic))
@@ -1,5 +1,16 @@
 from django.core.exceptions import ValidationError
-from django.forms.fields import Field
+from django.utils.translation import get_language
+
+try:
+    from django.utils.translation import ugettext as _
+except ImportError:
+    from django.utils.translation import gettext as _
+
+
+def get_attrname(operand):
+    if isinstance(operand, BaseOperator):
+        return operand.attrname
+    return operand
 
 
 class BaseOperator(object):
@@ -8,53 +19,118 @@ class BaseOperator(object):
     def __init__(self, *args, **kwargs):
         self.operands = args
         self.required = kwargs.get('required', False)
+        self.messages = {}
+        self.all_operands = ()
+        for each in args:
+            if isinstance(each, BaseOperator):
+                self.all_operands += each.all_operands
+            else:
+                self.all_operands += (each,)
+        separator = ' %s ' %self.__class__.__name__
+        self.text = '( %s )' %separator.join(str(each) for each in args)
 
-    def __len__(self):
-        size = lambda x: len(x) if isinstance(x, BaseOperator) else 1
-        return sum(size(each) for each in self.operands)
-        
-    def iter_all_operands(self):
+    @classmethod
+    def create(cls, *args, **kwargs):
+        return cls(*args, **kwargs)
+
+    def bind(self, fields):
+        """
+        Return a copy of the operator whose operands are resolved against
+        the form class `fields`. Fields are referenced by name only, so the
+        bound operator can be shared by every instance of the form class.
+        """
+        args = []
+        for each in self.operands:
+            if isinstance(each, BaseOperator):
+                args.append( each.bind(fields) )
+            elif each in fields:
+                args.append( each )
+            else:
+                raise KeyError(each)
+        return self.create(*args, required=self.required, fields=fields)
+
+    def compile(self, positions):
+        """
+        Precompute the bitmasks used by `evaluate`. `positions` maps each
+        field name to its bit in the "present fields" bitmask.
+        """
+        self.mask = 0
+        self.nested = ()
+        self.order = ()
         for each in self.operands:
             if isinstance(each, BaseOperator):
-                for i in each.iter_all_operands():
-                    yield i
+                each.compile(positions)
+                self.nested += (each,)
+                self.order += ((0, each.attrname, each),)
             else:
-                yield each
+                bit = positions[each]
+                self.mask |= bit
+                self.order += ((bit, each, None),)
+        self.all_mask = self.mask
+        for each in self.nested:
+            self.all_mask |= each.all_mask
+        self.all_operand_bits = tuple(
+            (name, positions[name]) for name in self.all_operands)
+        try:
+            self.absent = self.evaluate_in_order(0)
+            self.absent_is_valid = True
+        except ValidationError:
+            self.absent = None
+            self.absent_is_valid = False
+
+    def __len__(self):
+        return len(self.all_operands)
+        
+    def iter_all_operands(self):
+        return self.all_operands
         
     def __str__(self):
-        func = lambda x,y: "%s %s %s" %(
-            x.attrname if isinstance(x, Field) else x, 
-            self.__class__.__name__ ,
-            y.attrname if isinstance(y, Field) else y,
-        )
-        return "( %s )" % reduce(func, self.operands)
+        return self.text
+
+    def get_message(self):
+        """
+        The error message of the operator, built once per active language.
+        """
+        language = get_language()
+        try:
+            return self.messages[language]
+        except KeyError:
+            text = self.messages[language] = _('Expected logic: %s') %self
+            return text
 
     def raise_exception(self, subject, subjects=None):
-        text = 'Expected logic: %s' %self
-        exception = ValidationError(text)
+        exception = ValidationError(self.get_message())
         exception.subject = subject
         exception.subjects = subjects or []
         raise exception
     
     def data_exists(self, obj, validated_data):
-        if isinstance(obj, Field):
-            return validated_data.get(obj.attrname)
-        else:
+        if isinstance(obj, BaseOperator):
             return obj.is_valid(validated_data)
+        return validated_data.get(obj)
         
 
 class OR(BaseOperator):
     
-    @classmethod
-    def create(cls, *args, **kwargs):
-        return cls(*args, **kwargs)
+    def evaluate(self, present):
+        if not present & self.all_mask and self.absent_is_valid:
+            return self.absent
+        return self.evaluate_in_order(present)
+    
+    def evaluate_in_order(self, present):
+        if present & self.mask or self.nested:
+            for bit,attrname,operator in self.order:
+                if (present & bit) if bit else operator.evaluate(present):
+                    return attrname
+        if self.required:
+            self.raise_exception(subject=get_attrname(self.operands[-1]))
     
     def is_valid(self, validated_data):
         for each in self.operands:
             if self.data_exists(each, validated_data):
-                return each.attrname
+                return get_attrname(each)
         if self.required:
-            self.raise_exception(subject=each.attrname)
+            self.raise_exception(subject=get_attrname(each))
 
 
 class AND(BaseOperator):
@@ -62,19 +138,48 @@ class AND(BaseOperator):
     @classmethod
     def create(cls, *args, **kwargs):
         instance = cls(*args, **kwargs)
+        fields = kwargs.get('fields', {})
         if not instance.required:
-            instance.required = any(each.required for each in instance.operands)
+            instance.required = any(
+                fields[each].required if each in fields else each.required
+                for each in instance.operands
+            )
         return instance
     
+    def evaluate(self, present):
+        if not present & self.all_mask and self.absent_is_valid:
+            return self.absent
+        found = present & self.mask
+        try:
+            nested = [each.evaluate(present) for each in self.nested]
+        except ValidationError:
+            return self.evaluate_in_order(present)
+        if found == self.mask and all(nested):
+            return True
+        if not self.required and not found and not any(nested):
+            return True
+        return self.evaluate_in_order(present)
+    
+    def evaluate_in_order(self, present):
+        validated = []
+        for bit,attrname,operator in self.order:
+            if not ((present & bit) if bit else operator.evaluate(present)):
+                if self.required:
+                    self.raise_exception(subject=attrname)
+            else:
+                validated.append( attrname )
+        if 0 < len(validated) < len(self.operands):
+            self.raise_exception(subject=validated[0], subjects=validated[1:])
+        return True
+    
     def is_valid(self, validated_data):
         validated = []
         for each in self.operands:
             if not self.data_exists(each, validated_data):
                 if self.required:
-                    self.raise_exception(subject=each.attrname)
+                    self.raise_exception(subject=get_attrname(each))
             else:
-                validated.append( each.attrname )
+                validated.append( get_attrname(each) )
         if 0 < len(validated) < len(self.operands):
             self.raise_exception(subject=validated[0], subjects=validated[1:])
         return True
-    
\ No newline at end of file
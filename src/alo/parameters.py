@@ -0,0 +1,119 @@
+from .coords import resolve
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+
+class Parameters(MutableMapping):
+    """
+    Mapping of lookups to values, worked out from the form's
+    `_validated_data` when it is read. The result of each
+    `multifield_lookups` callable is kept until one of the values of its
+    fields changes (is replaced by another object), so changing
+    `_validated_data` only recomputes the groups that field belongs to.
+    Lookups set or deleted on the mapping itself are kept on top of the
+    computed ones. `dict(parameters)` or `copy()` gives a plain dict.
+
+    Reading a lookup set by a single field does not run the
+    `multifield_lookups` callables, so such a lookup takes precedence over
+    the same key returned by a callable. Any other key runs all of them.
+    Iterating, `len()`, `keys()`, `items()` and `values()` build the whole
+    dict on every call; take a `copy()` to use it more than once.
+    """
+    def __init__(self, form):
+        self.form = form
+        self.memo = {}
+        self.overrides = {}
+        self.deleted = set()
+
+    def clone(self, form):
+        """
+        A copy bound to `form`, sharing the multifield results computed so far.
+        """
+        clone = self.__class__(form)
+        clone.memo = dict(self.memo)
+        clone.overrides = dict(self.overrides)
+        clone.deleted = set(self.deleted)
+        return clone
+
+    def get_group(self, fields, call):
+        data = self.form._validated_data
+        values = tuple(data.get(name) for name in fields)
+        try:
+            previous, result = self.memo[fields]
+        except KeyError:
+            pass
+        else:
+            if all(a is b for a,b in zip(previous, values)):
+                return result
+        if any(each is None for each in values):
+            result = {}
+        else:
+            result = call(*[resolve(each) for each in values])
+        self.memo[fields] = (values, result)
+        return result
+
+    def get_groups(self):
+        groups = {}
+        for fields,call in self.form._meta.multifield_lookups.items():
+            groups.update(self.get_group(fields, call))
+        return groups
+
+    def __getitem__(self, key):
+        if key in self.overrides:
+            return self.overrides[key]
+        if key in self.deleted:
+            raise KeyError(key)
+        return self.get_computed(key)
+
+    def get_computed(self, key):
+        data = self.form._validated_data
+        for fieldname in reversed(self.form._meta.lookup_fields.get(key, ())):
+            if fieldname in data:
+                return resolve(data[fieldname])
+        groups = self.get_groups()
+        if key in groups:
+            return groups[key]
+        raise KeyError(key)
+
+    def copy(self):
+        meta = self.form._meta
+        parameters = self.get_groups()
+        parameters.update(
+            (meta.lookups[k], resolve(v)) for k,v in self.form._validated_data.items()
+            if k not in meta.ignore and k not in meta.grouped_fields
+        )
+        for key in self.deleted:
+            parameters.pop(key, None)
+        parameters.update(self.overrides)
+        return parameters
+
+    def __setitem__(self, key, value):
+        self.overrides[key] = value
+        self.deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.overrides.pop(key, None)
+        self.deleted.add(key)
+
+    def __iter__(self):
+        return iter(self.form.get_parameters())
+
+    def __len__(self):
+        return len(self.form.get_parameters())
+
+    def keys(self):
+        return self.form.get_parameters().keys()
+
+    def items(self):
+        return self.form.get_parameters().items()
+
+    def values(self):
+        return self.form.get_parameters().values()
+
+    def __repr__(self):
+        return 'Parameters(%r)' %self.form.get_parameters()
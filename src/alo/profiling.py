@@ -0,0 +1,210 @@
+"""
+Sampled profiling of form validation per URL name.
+
+Add `alo.profiling.ProfilingMiddleware` to the middleware and set
+
+- `ALO_PROFILE_FILE`: where samples are appended, one JSON line each
+- `ALO_PROFILE_RATE`: fraction of requests to sample (defaults to `0.01`)
+
+then read the report with `python manage.py alo_profile`.
+
+A sample holds the time the request spent in `alo` (the `full_clean` and
+`get_parameters` phases of its forms) and in database queries, which
+include the instance lookup of the `validate` decorator and the filtered
+query of the view. Query time needs Django 2.0 or newer.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from collections import defaultdict
+from timeit import default_timer
+from . import instrumentation
+from .instrumentation import Recorder, get_label
+import json
+import math
+import random
+import threading
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+try:
+    from asgiref.local import Local
+except ImportError:
+    from threading import local as Local
+
+
+ALO_PHASES = ('full_clean', 'get_parameters')
+
+
+class Sample(object):
+    def __init__(self):
+        self.alo = 0.0
+        self.query = 0.0
+        self.forms = defaultdict(float)
+        self.failures = defaultdict(lambda: defaultdict(int))
+
+    def as_dict(self, url_name):
+        return {
+            'url_name': url_name,
+            'alo': self.alo,
+            'query': self.query,
+            'forms': dict(self.forms),
+            'failures': dict((k, dict(v)) for k,v in self.failures.items()),
+        }
+
+
+class ProfileRecorder(Recorder):
+    """
+    Add the timings and rule failures of the current request, if it is
+    being sampled, to its `Sample`.
+    """
+    def __init__(self):
+        self.local = Local()
+        self.lock = threading.Lock()
+        self.active = 0
+
+    def get_sample(self):
+        return getattr(self.local, 'sample', None)
+
+    def start(self):
+        self.local.sample = Sample()
+        with self.lock:
+            self.active += 1
+            instrumentation.add_recorder(self)
+        return self.local.sample
+
+    def stop(self):
+        sample = self.get_sample()
+        self.local.sample = None
+        with self.lock:
+            self.active -= 1
+            if not self.active:
+                instrumentation.remove_recorder(self)
+        return sample
+
+    def timing(self, form_class, phase, seconds):
+        sample = self.get_sample()
+        if sample is not None and phase in ALO_PHASES:
+            sample.alo += seconds
+            sample.forms[get_label(form_class)] += seconds
+
+    def incr(self, form_class, metric, value, rule):
+        sample = self.get_sample()
+        if sample is not None and metric == 'rule_failures':
+            sample.failures[get_label(form_class)][rule] += value
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+
+    def __init__(self, get_response=None):
+        if get_response is not None:
+            super(ProfilingMiddleware, self).__init__(get_response)
+        self.path = getattr(settings, 'ALO_PROFILE_FILE', None)
+        if not self.path:
+            raise ImproperlyConfigured(
+                'ProfilingMiddleware requires the ALO_PROFILE_FILE setting.')
+        self.rate = getattr(settings, 'ALO_PROFILE_RATE', 0.01)
+        self.recorder = ProfileRecorder()
+        self.lock = threading.Lock()
+
+    def process_request(self, request):
+        if random.random() >= self.rate:
+            return
+        sample = self.recorder.start()
+
+        def time_query(execute, sql, params, many, context):
+            start = default_timer()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                sample.query += default_timer() - start
+
+        request._alo_query_timer = time_query
+        for connection in connections.all():
+            if hasattr(connection, 'execute_wrappers'):
+                connection.execute_wrappers.append(time_query)
+
+    def process_response(self, request, response):
+        time_query = request.__dict__.pop('_alo_query_timer', None)
+        if time_query is None:
+            return response
+        for connection in connections.all():
+            if time_query in getattr(connection, 'execute_wrappers', ()):
+                connection.execute_wrappers.remove(time_query)
+        sample = self.recorder.stop()
+        if sample.forms:
+            self.save(sample, get_url_name(request))
+        return response
+
+    def save(self, sample, url_name):
+        line = json.dumps(sample.as_dict(url_name), sort_keys=True)
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+
+def get_url_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is not None and match.view_name:
+        return match.view_name
+    return request.path_info
+
+
+def load_samples(path):
+    samples = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                samples.append(json.loads(line))
+    return samples
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a sorted list.
+    """
+    if not values:
+        return None
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+def get_percentiles(values):
+    values = sorted(values)
+    return tuple(percentile(values, p) for p in (50, 95, 99))
+
+
+def summarize(samples, top=10):
+    """
+    Aggregate samples into a report:
+
+    - `urls`: `(url_name, count, alo percentiles, query percentiles)`,
+      slowest alo p95 first
+    - `forms`: `(form, count, alo percentiles)`, slowest p95 first
+    - `rules`: `(form, rule, failures)`, most failures first
+    """
+    urls = defaultdict(lambda: ([], []))
+    forms = defaultdict(list)
+    rules = defaultdict(int)
+    for sample in samples:
+        alo, query = urls[sample['url_name']]
+        alo.append(sample['alo'])
+        query.append(sample['query'])
+        for form,seconds in sample['forms'].items():
+            forms[form].append(seconds)
+        for form,failures in sample['failures'].items():
+            for rule,count in failures.items():
+                rules[(form, rule)] += count
+    urls = sorted(
+        ((name, len(alo), get_percentiles(alo), get_percentiles(query))
+         for name,(alo,query) in urls.items()),
+        key=lambda each: each[2][1], reverse=True)
+    forms = sorted(
+        ((form, len(values), get_percentiles(values)) for form,values in forms.items()),
+        key=lambda each: each[2][1], reverse=True)
+    rules = sorted(
+        ((form, rule, count) for (form,rule),count in rules.items()),
+        key=lambda each: each[2], reverse=True)
+    return {'urls': urls, 'forms': forms[:top], 'rules': rules[:top]}
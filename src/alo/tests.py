@@ -1,13 +1,24 @@
 #!/usr/bin/env python
 # encoding: utf-8
+import django
+import os
+import subprocess
+import sys
 from django.test import TestCase
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
 from django.test.client import Client, RequestFactory
 from django.http import HttpResponse
+from django.db.models import Q
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from .forms import QueryForm, QueryModelForm, Field
 from .operators import AND, OR, BaseOperator
 from .decorators import validate
 
+try:
+    from .async_tests import AsyncValidateTestCase
+except (ImportError, SyntaxError):
+    pass
+
 
 A = Field(required=False)
 B = Field(required=False)
@@ -15,6 +26,13 @@ C = Field(required=False)
 D = Field(required=False)
 E = Field(required=False)
 F = Field(required=False)
+
+
+class StreamForm(QueryForm):
+    a, b = A, B
+
+    class Meta:
+        extralogic = [AND('a', 'b'),]
             
 
 class QueryModelFormTestCase(TestCase):
@@ -39,34 +57,61 @@ class QueryModelFormTestCase(TestCase):
         
         request = factory.get('', {'username':1})
         response = decorator(view)(request, pk=user.pk)
-        self.assertNotEqual(response.content, 'success')
+        self.assertNotEqual(response.content, b'success')
         self.assertEqual(request.form.instance, user)
         
         request = factory.get('', {'username':'user', 'email':'1@email.com'})
         response = decorator(view)(request, pk=user.pk)
-        self.assertEqual(response.content, 'success')
+        self.assertEqual(response.content, b'success')
         self.assertEqual(request.form.instance, user)
         
         request = factory.get('')
         response = decorator(view)(request, pk=user.pk)
-        self.assertNotEqual(response.content, 'success')
+        self.assertNotEqual(response.content, b'success')
         self.assertEqual(request.form.instance, user)
         
         decorator = validate(Form, add_instance_using='id')
         request = factory.get('', {})
         response = decorator(another_view)(request, id=user.pk)
-        self.assertNotEqual(response.content, 'success')
+        self.assertNotEqual(response.content, b'success')
         self.assertEqual(request.form.instance, user)
         
         decorator = validate(Form, add_instance_using='id')
         request = factory.get('', {'username':1})
         response = decorator(another_view)(request, pk=user.pk)
-        self.assertNotEqual(response.content, 'success')
+        self.assertNotEqual(response.content, b'success')
         self.assertNotEqual(request.form.instance, user)
         
 
+    def test_validate_many(self):
+        
+        class Form(QueryModelForm):
+            class Meta:
+                model = User
+                fields = ('first_name', 'email')
+                extralogic = [AND('first_name', 'email'),]
+        
+        results = list(Form.validate_many([
+            {'first_name': 'a', 'email': 'a@email.com'},
+            {'first_name': 'b'},
+            {'email': 'c@email.com'},
+        ]))
+        self.assertEqual(results[0], ({'first_name': 'a', 'email': 'a@email.com'}, {}))
+        self.assertEqual(list(results[1][1]), ['first_name'])
+        self.assertEqual(list(results[2][1]), ['email'])
+        
+
 class QueryFormTestCase(TestCase):
 
+    def test_lazy_geo_fields(self):
+        if sys.version_info < (3, 7):
+            return
+        code = ("import django, sys; django.setup(); import alo.forms; "
+                "print('django.contrib.gis.geos' in sys.modules)")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.check_output([sys.executable, '-c', code], env=env)
+        self.assertEqual(output.strip(), b'False')
+    
     def test_BoundingBoxField(self):
         try:
             from .forms import BoundingBoxField
@@ -106,6 +151,27 @@ class QueryFormTestCase(TestCase):
         self.assertEqual(polygon2.num_points, 5)
         self.assertEqual(polygon2, f.parameters['point__contained'])
         self.assertEqual(polygon1, polygon2)
+        self.assertEqual(polygon1.extent, (lng1, lat0, lng0, lat1))
+        from django.contrib.gis.geos import MultiPoint, Point
+        envelope = MultiPoint(Point(lng0, lat0), Point(lng1, lat1)).envelope
+        self.assertEqual(f.parameters['point__contained'], envelope)
+        
+        class Form(QueryForm):
+            box = BoundingBoxField(as_extent=True)
+            
+            class Meta:
+                lookups = {
+                    'box': 'point__contained'
+                }
+        
+        f = Form({
+            'box_0': '%s,%s'%(lng0,lat0),
+            'box_1': '%s,%s'%(lng1,lat1),
+        })
+        self.assertTrue(f.is_valid())
+        self.assertEqual(f.parameters['point__contained'], (lng1, lat0, lng0, lat1))
+        self.assertEqual(Form.base_fields['box'].widget.decompress(polygon1),
+            [Point(lng1, lat0), Point(lng0, lat1)])
         
     def test_CoordsField(self):
         try:
@@ -135,6 +201,69 @@ class QueryFormTestCase(TestCase):
         f = Form({'coords': '%s,%s'%(lat,lng)})
         assert_form(lat=lat, lng=lng, form=f)
 
+    def test_MultiCoordsField(self):
+        try:
+            from .forms import MultiCoordsField
+            from . import fields
+        except ImportError:
+            return
+        
+        class Form(QueryForm):
+            points = MultiCoordsField()
+            line = MultiCoordsField(latitude_first=True, geometry='linestring',
+                                    max_points=3)
+        
+        numpy = fields.numpy
+        try:
+            for fields.numpy in set([numpy, None]):
+                f = Form({'points': '-8.1,40.0;-9.1,41.0', 'line': '40.0,-8.1;41.0,-9.1'})
+                self.assertTrue(f.is_valid())
+                self.assertEqual(f.cleaned_data['points'].geom_type, 'MultiPoint')
+                self.assertEqual(f.cleaned_data['points'].coords, ((-8.1, 40.0), (-9.1, 41.0)))
+                self.assertEqual(f.cleaned_data['line'].geom_type, 'LineString')
+                self.assertEqual(f.cleaned_data['line'].coords, ((-8.1, 40.0), (-9.1, 41.0)))
+                self.assertEqual(f.parameters['line'], f.cleaned_data['line'])
+                for value in ['1,2;3', 'a,b', 'nan,1', '1,91', '1,2;3,4;5,6;7,8', '1,2']:
+                    f = Form({'line': value})
+                    self.assertFalse(f.is_valid(), value)
+                    self.assertTrue('line' in f.errors)
+                for value in ['1,2,3,4', '1;2', '1,2;', '1,2;3,4,5;6']:
+                    f = Form({'points': value})
+                    self.assertFalse(f.is_valid(), value)
+                    self.assertEqual(f.errors['points'], [f.fields['points'].error_messages['no_pair']])
+        finally:
+            fields.numpy = numpy
+    
+    def test_lazy_geometry(self):
+        try:
+            from .forms import CoordsField, BoundingBoxField, CircleField
+            from django.contrib.gis.geos import Point
+        except ImportError:
+            return
+        import pickle
+        from .coords import Coords
+        
+        class Form(QueryForm):
+            coords = CoordsField(required=False)
+            box = BoundingBoxField(required=False)
+            center = CircleField(required=False)
+            
+            class Meta:
+                ignore = ['box']
+        
+        f = Form({'coords': '-8.1,40.0', 'box_0': '-8.1,40.0', 'box_1': '-9.1,41.0',
+                  'center': '-8.1,40.0'})
+        self.assertTrue(f.is_valid())
+        coords, box = f.cleaned_data['coords'], f.cleaned_data['box']
+        self.assertTrue(isinstance(coords, Coords))
+        self.assertEqual(coords._geometry, None)
+        self.assertEqual(f.cleaned_data['center'][0]._geometry, None)
+        self.assertTrue(isinstance(f.parameters['coords'], Point))
+        self.assertTrue(isinstance(f.parameters['center'][0], Point))
+        self.assertEqual(box._geometry, None)
+        self.assertEqual(pickle.loads(pickle.dumps(coords)), coords)
+        self.assertEqual(pickle.loads(pickle.dumps(box)), box)
+    
     def test_CircleField(self):
         try:
             from .forms import CircleField
@@ -153,6 +282,73 @@ class QueryFormTestCase(TestCase):
         self.assertEqual(coords[0], lng)
         self.assertEqual(coords[1], lat)
         self.assertEqual(f.cleaned_data['center'], f.parameters['center'])
+        from .cache import make_key
+        g = Form({'center': '%s,%s'%(lng,lat)})
+        self.assertTrue(g.is_valid())
+        self.assertEqual(make_key(f.parameters), make_key(g.parameters))
+        g = Form({'center': '%s,%s'%(lng,lat+1)})
+        self.assertTrue(g.is_valid())
+        self.assertNotEqual(make_key(f.parameters), make_key(g.parameters))
+    
+    def test_CircleField_prefilter(self):
+        try:
+            from .forms import CircleField, CoordsField, IntegerField, distance_lookups
+            from django.contrib.gis.geos import Point
+            from django.contrib.gis.measure import D
+        except ImportError:
+            return
+        
+        class Form(QueryForm):
+            center = CircleField(distance=10, prefilter='bboverlaps')
+            
+            class Meta:
+                lookups = {'center': 'point__distance_lte'}
+        
+        f = Form({'center': '-8.1,40.0'})
+        self.assertTrue(f.is_valid())
+        parameters = f.parameters
+        self.assertEqual(set(parameters), set(['point__bboverlaps', 'point__distance_lte']))
+        self.assertEqual(parameters['point__distance_lte'], (Point(-8.1, 40.0), D(km=10)))
+        xmin, ymin, xmax, ymax = parameters['point__bboverlaps'].extent
+        self.assertAlmostEqual(ymax - 40.0, 10000 / 110574.0)
+        self.assertAlmostEqual(40.0 - ymin, 10000 / 110574.0)
+        self.assertAlmostEqual(xmax + 8.1, -8.1 - xmin)
+        self.assertTrue(xmax + 8.1 > ymax - 40.0)
+        self.assertEqual(f.cleaned_data['center'].extent, (xmin, ymin, xmax, ymax))
+        
+        class Form(QueryForm):
+            center = CoordsField(required=False)
+            radius = IntegerField(required=False)
+            
+            class Meta:
+                multifield_lookups = {
+                    ('center', 'radius'): distance_lookups('point', prefilter='dwithin'),
+                }
+        
+        f = Form({'center': '-8.1,89.99', 'radius': '100'})
+        self.assertTrue(f.is_valid())
+        point, degrees = f.parameters['point__dwithin']
+        self.assertEqual(f.parameters['point__distance_lte'], (point, D(km=100)))
+        self.assertTrue(degrees > 180)
+        self.assertRaises(ValueError, distance_lookups, 'point', prefilter='within')
+        self.assertRaises(ValueError, distance_lookups, 'point', comparison='distance_gt')
+        
+        class Form(QueryForm):
+            center = CircleField(distance=10, prefilter='dwithin')
+            
+            class Meta:
+                lookups = {'center': 'point__distance_lt'}
+        
+        f = Form({'center': '-8.1,40.0'})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(set(f.parameters), set(['point__dwithin', 'point__distance_lt']))
+        
+        for lookup in ['point__distance_gte', 'point__dwithin']:
+            attrs = {
+                'center': CircleField(prefilter='bboverlaps'),
+                'Meta': type('Meta', (object,), {'lookups': {'center': lookup}}),
+            }
+            self.assertRaises(ImproperlyConfigured, type(QueryForm), 'Form', (QueryForm,), attrs)
 
     def test_validate_decorator(self):
         
@@ -170,11 +366,166 @@ class QueryFormTestCase(TestCase):
         request = factory.get('', {'a':1})
         wrapper = decorator(view)
         self.assertEqual(wrapper.__name__, view.__name__)
-        self.assertNotEqual(wrapper(request).content, 'success')
+        self.assertNotEqual(wrapper(request).content, b'success')
         request = factory.get('', {'a':1, 'b':1})
-        self.assertEqual(wrapper(request).content, 'success')
+        self.assertEqual(wrapper(request).content, b'success')
         request = factory.get('')
-        self.assertEqual(wrapper(request).content, 'success')
+        self.assertEqual(wrapper(request).content, b'success')
+    
+    def test_validate_decorator_request_position(self):
+        
+        class Form(QueryForm):
+            a, b = A, B
+    
+            class Meta:
+                extralogic = [AND('a', 'b'),]
+        
+        class View(object):
+            @validate(Form)
+            def get(self, request):
+                return HttpResponse('success')
+        
+        factory = RequestFactory()
+        view = View()
+        request = factory.get('', {'a':1, 'b':1})
+        self.assertEqual(view.get(request).content, b'success')
+        self.assertTrue(request.form.is_valid())
+        request = factory.get('', {'a':1})
+        self.assertEqual(view.get(request).status_code, 400)
+        self.assertFalse(request.form.is_valid())
+        decorated = validate(Form)(lambda *args: HttpResponse('success'))
+        request = factory.get('', {'a':1, 'b':1})
+        self.assertEqual(decorated(request).content, b'success')
+        self.assertEqual(decorated(None, request).content, b'success')
+        self.assertEqual(decorated(request).content, b'success')
+    
+    def test_validate_decorator_dumps(self):
+        import json
+        
+        class Form(QueryForm):
+            a, b = A, B
+    
+            class Meta:
+                extralogic = [AND('a', 'b'),]
+        
+        def view(request):
+            return HttpResponse('success')
+        
+        factory = RequestFactory()
+        response = validate(Form, dumps=json.dumps)(view)(factory.get('', {'a':1}))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(content, {'Errors': {'a': ['Expected logic: ( a AND b )']}})
+        response = validate(Form)(view)(factory.get('', {'a':1}))
+        self.assertEqual(json.loads(response.content.decode('utf-8')), content)
+        operator = Form._meta.extralogic[0]
+        self.assertTrue(operator.get_message() is operator.get_message())
+    
+    def test_validate_decorator_memoize(self):
+        calls = []
+        
+        class Form(QueryForm):
+            a, b = A, B
+    
+            class Meta:
+                extralogic = [AND('a', 'b'),]
+            
+            def full_clean(self):
+                calls.append(1)
+                super(Form, self).full_clean()
+        
+        def view(request):
+            request.form.parameters['c'] = 1
+            return HttpResponse(str(sorted(request.form.parameters)))
+        
+        factory = RequestFactory()
+        wrapper = validate(Form, memoize=2)(view)
+        request = factory.get('', {'a':1, 'b':1})
+        self.assertEqual(wrapper(request).content, str(['a', 'b', 'c']).encode())
+        request = factory.get('', {'b':1, 'a':1})
+        self.assertEqual(wrapper(request).content, str(['a', 'b', 'c']).encode())
+        self.assertEqual(len(calls), 1)
+        request = factory.get('', {'a':1})
+        response = wrapper(request)
+        self.assertEqual(response.status_code, 400)
+        request = factory.get('', {'a':1})
+        self.assertEqual(wrapper(request).content, response.content)
+        self.assertEqual(wrapper(request).status_code, 400)
+        self.assertFalse(request.form.is_valid())
+        self.assertEqual(len(calls), 2)
+        wrapper(factory.get('', {'b':1}))
+        wrapper(factory.get('', {'a':1, 'b':1}))
+        self.assertEqual(len(calls), 4)
+        wrapper(factory.post('', {'a':1, 'b':1}))
+        wrapper(factory.post('', {'a':1, 'b':1}))
+        self.assertEqual(len(calls), 6)
+        
+        counter = iter(range(1, 10))
+        
+        class Form(QueryForm):
+            a = Field(required=False, initial=lambda: next(counter))
+        
+        wrapper = validate(Form, memoize=2)(view)
+        values = []
+        for i in range(2):
+            request = factory.get('')
+            wrapper(request)
+            values.append(request.form.parameters['a'])
+        self.assertEqual(values, [1, 2])
+        
+        class Form(QueryModelForm):
+            class Meta:
+                model = User
+                fields = ('username',)
+        
+        def create(request):
+            return HttpResponse(str(request.form.save().pk))
+        
+        wrapper = validate(Form, memoize=2)(create)
+        self.assertEqual(wrapper(factory.get('', {'username': 'new'})).status_code, 200)
+        # Validated again, so the username is now taken
+        self.assertEqual(wrapper(factory.get('', {'username': 'new'})).status_code, 400)
+        self.assertEqual(User.objects.filter(username='new').count(), 1)
+    
+    def test_validate_many(self):
+        
+        class Form(QueryForm):
+            a, b = A, B
+            c = Field(required=False, initial=1)
+    
+            class Meta:
+                lookups = {'a': 'a__contains'}
+                extralogic = [AND('a', 'b'),]
+        
+        results = Form.validate_many([{'a': 1, 'b': 2}, {'a': 1}, {}, {'c': 2}])
+        self.assertFalse(isinstance(results, list))
+        results = list(results)
+        self.assertEqual(results[0], ({'a__contains': 1, 'b': 2, 'c': 1}, {}))
+        self.assertEqual(results[1][0], None)
+        self.assertEqual(list(results[1][1]), ['a'])
+        self.assertEqual(results[2], ({'c': 1}, {}))
+        self.assertEqual(results[3], ({'c': 2}, {}))
+    
+    def test_validate_stream(self):
+        payloads = [{'a': i, 'b': i} if i % 3 else {'a': i} for i in range(1, 50)]
+        expected = [
+            ({'a': i, 'b': i}, {}) if i % 3 else
+            (None, {'a': ['Expected logic: ( a AND b )']}) for i in range(1, 50)
+        ]
+        results = StreamForm.validate_stream(iter(payloads), chunksize=7)
+        self.assertFalse(isinstance(results, list))
+        self.assertEqual(list(results), expected)
+        try:
+            from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        except ImportError:
+            return
+        for executor_class in (ThreadPoolExecutor, ProcessPoolExecutor):
+            executor = executor_class(max_workers=2)
+            results = StreamForm.validate_stream(
+                iter(payloads), chunksize=5, executor=executor, pending=3)
+            self.assertEqual(list(results), expected)
+            executor.shutdown()
     
     def test_lookups(self):
         
@@ -198,6 +549,245 @@ class QueryFormTestCase(TestCase):
         self.assertEqual(f._meta.lookups['c'], 'c')
         self.assertFalse('c__year' in lookups)
     
+    def test_compiled_meta(self):
+        
+        class Form(QueryForm):
+            a, b, c = A, B, C
+    
+            class Meta:
+                lookups = {'a': 'a__contains'}
+                ignore = ['c']
+                extralogic = [AND('a', 'b')]
+        
+        self.assertEqual(Form._meta.lookups['a'], 'a__contains')
+        self.assertEqual(Form._meta.ignore, frozenset(['c']))
+        self.assertEqual(len(Form._meta.extralogic), 1)
+        f1, f2 = Form({'a': 1}), Form({'a': 1, 'b': 1})
+        self.assertTrue(f1._meta is Form._meta)
+        self.assertTrue(f2._meta is Form._meta)
+        self.assertFalse(f1.is_valid())
+        self.assertTrue(f2.is_valid())
+        
+        class SubForm(Form):
+            d = D
+        
+        self.assertFalse(SubForm._meta is Form._meta)
+        self.assertTrue('d' in SubForm._meta.lookups)
+        self.assertFalse('d' in Form._meta.lookups)
+    
+    def test_extralogic_binding(self):
+        
+        class Form(QueryForm):
+            a, b = A, B
+    
+            class Meta:
+                extralogic = [AND('a', 'b')]
+        
+        class OtherForm(QueryForm):
+            b, a = A, B
+    
+            class Meta:
+                extralogic = [OR('a', 'b')]
+        
+        f = Form({'a': 1})
+        self.assertFalse(f.is_valid())
+        self.assertTrue(f._meta.extralogic is Form._meta.extralogic)
+        self.assertFalse(hasattr(A, 'attrname'))
+        self.assertFalse(hasattr(f.fields['a'], 'attrname'))
+        f = OtherForm({'a': 1, 'b': 1})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(list(f.parameters), ['a'])
+    
+    def test_callable_defaults(self):
+        counter = []
+        
+        def initial():
+            counter.append(1)
+            return len(counter)
+        
+        class Form(QueryForm):
+            a = Field(required=False, initial=initial)
+        
+        self.assertEqual(len(counter), 0)
+        f = Form({})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(f.parameters['a'], 1)
+        f = Form({})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(f.parameters['a'], 2)
+        f = Form({'a': 'given'})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(f.parameters['a'], 'given')
+        self.assertEqual(len(counter), 2)
+        
+        from . import mixins
+        
+        class Form(QueryForm):
+            a = Field(required=False, initial=initial)
+            
+            class Meta:
+                memoize_defaults = {'a': 60}
+        
+        clock = mixins.clock
+        now = [1000]
+        mixins.clock = lambda: now[0]
+        try:
+            Form({})
+            self.assertEqual(len(counter), 2)
+            values = []
+            for each in range(3):
+                f = Form({})
+                self.assertTrue(f.is_valid())
+                values.append(f.parameters['a'])
+            now[0] += 61
+            f = Form({})
+            self.assertTrue(f.is_valid())
+            values.append(f.parameters['a'])
+        finally:
+            mixins.clock = clock
+        self.assertEqual(values, [3, 3, 3, 4])
+        
+    def test_as_q(self):
+        
+        class Form(QueryForm):
+            a, b, c = A, B, C
+    
+            class Meta:
+                lookups = {'a': 'a__contains', 'b': 'b__id'}
+                extralogic = [OR('a', 'b')]
+        
+        f = Form({'a': 1, 'b': 2, 'c': 3})
+        self.assertTrue(f.is_valid())
+        q = f.as_q()
+        self.assertEqual(q.connector, Q.AND)
+        self.assertEqual(sorted(q.children), [('a__contains', 1), ('c', 3)])
+        q = f.as_q(alternatives=True)
+        self.assertEqual(str(q), str((Q(a__contains=1) | Q(b__id=2)) & Q(c=3)))
+        f = Form({'b': 2})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(str(f.as_q()), str(Q(b__id=2)))
+        self.assertEqual(str(f.as_q(alternatives=True)), str(Q(b__id=2)))
+        
+        class Form(QueryForm):
+            title = Field(required=False)
+            year = Field(required=False, initial=2026)
+            
+            class Meta:
+                lookups = {'title': 'title__icontains', 'year': 'date__year'}
+                extralogic = [OR('title', 'year')]
+        
+        f = Form({'title': 'foo'})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(str(f.as_q()), str(Q(title__icontains='foo')))
+        self.assertEqual(str(f.as_q(alternatives=True)), str(Q(title__icontains='foo')))
+        f = Form({'title': 'foo', 'year': '2000'})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(str(f.as_q(alternatives=True)),
+                         str(Q() & (Q(title__icontains='foo') | Q(date__year='2000')) & Q()))
+        
+        class Form(QueryForm):
+            year = Field(required=False)
+            range = Field(required=False, initial='5')
+            title = Field(required=False)
+            
+            class Meta:
+                multifield_lookups = {
+                    ('year', 'range'): lambda year, range: {'year__range': (year, range)},
+                }
+                extralogic = [OR('year', 'title')]
+        
+        f = Form({'year': '2000', 'title': 'x'})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(str(f.as_q()), str(Q(year__range=('2000', '5'))))
+        self.assertEqual(str(f.as_q(alternatives=True)), str(f.as_q()))
+        
+        class Form(QueryForm):
+            a, b = A, B
+            
+            class Meta:
+                ignore = ['a']
+                extralogic = [OR('a', 'b')]
+        
+        f = Form({'a': 1, 'b': 2})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(str(f.as_q()), str(Q()))
+        self.assertEqual(str(f.as_q(alternatives=True)), str(Q()))
+    
+    def test_apply(self):
+        
+        class Form(QueryForm):
+            username = Field(required=False)
+            email = Field(required=False)
+            
+            class Meta:
+                extralogic = [OR('username', 'email')]
+        
+        first = User.objects.create(username='first', email='first@email')
+        second = User.objects.create(username='second', email='second@email')
+        queryset = User.objects.order_by('pk')
+        f = Form({'username': 'first', 'email': 'second@email'})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(list(f.apply(queryset)), [first])
+        self.assertEqual(
+            list(f.apply(queryset, alternatives=True)), [first, second])
+        f = Form({})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(list(f.apply(queryset)), [first, second])
+        
+    def test_cached_queryset(self):
+        from .cache import make_key, get_version
+        from django.db.models.signals import post_save
+        
+        # Connected at startup, not by the first cached_queryset
+        self.assertTrue(post_save.has_listeners(Group))
+        version = get_version(Group)
+        Group.objects.create(name='other')
+        self.assertNotEqual(get_version(Group), version)
+        
+        class Form(QueryForm):
+            username = Field(required=False)
+            email = Field(required=False)
+        
+        self.assertEqual(make_key({'a': [1, 2], 'b': {'c'}}),
+                         make_key({'b': set(['c']), 'a': (1, 2)}))
+        self.assertNotEqual(make_key({'a': 1}), make_key({'a': 2}))
+        user = User.objects.create(username='user', email='user@email')
+        queryset = User.objects.all()
+        f = Form({'username': 'user'})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(f.cached_queryset(queryset), [user])
+        f = Form({'username': 'user'})
+        self.assertTrue(f.is_valid())
+        with self.assertNumQueries(0):
+            self.assertEqual(f.cached_queryset(queryset), [user])
+        user.username = 'other'
+        user.save()
+        self.assertEqual(f.cached_queryset(queryset), [])
+        self.assertEqual(f.cached_queryset(User.objects.none()), [])
+        f = Form({'username': ''})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(f.cached_queryset(User.objects.filter(pk__in=[])), [])
+        
+        class Form(QueryForm):
+            group = Field(required=False)
+            
+            class Meta:
+                lookups = {'group': 'groups__name'}
+        
+        group = Group.objects.create(name='first')
+        user.groups.add(group)
+        f = Form({'group': 'first'})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(f.cached_queryset(queryset), [user])
+        group.name = 'second'
+        group.save()
+        self.assertEqual(f.cached_queryset(queryset), [])
+        group.name = 'first'
+        group.save()
+        self.assertEqual(f.cached_queryset(queryset), [user])
+        user.groups.clear()
+        self.assertEqual(f.cached_queryset(queryset), [])
+        
     def test_multifield_lookups(self):
         
         class Form(QueryForm):
@@ -296,6 +886,87 @@ class QueryFormTestCase(TestCase):
         f = Form({'a': 1})
         self.assertTrue(f.is_valid())
         
+        class Form(QueryForm):
+            a, b = A, B
+            
+            class Meta:
+                required = ['a']
+        
+        self.assertTrue(Form.base_fields['a'].required)
+        self.assertFalse(A.required)
+        self.assertTrue(Form.base_fields['b'] is B)
+        self.assertFalse(Form({'b': 1}).is_valid())
+        
+        class Form(QueryModelForm):
+            class Meta:
+                model = User
+                fields = ('username', 'email')
+                required = ['email']
+        
+        self.assertFalse(Form.base_fields['username'].required)
+        self.assertTrue(Form.base_fields['email'].required)
+        self.assertFalse(Form({'username': 'user'}).is_valid())
+        
+    def test_copy_fields_on_write(self):
+        from .mixins import CopyOnWriteFields
+        
+        class Form(QueryForm):
+            a, b = A, B
+            
+            class Meta:
+                required = ['a']
+                copy_fields_on_write = True
+        
+        f = Form({'b': 1})
+        self.assertTrue(isinstance(f.fields, CopyOnWriteFields))
+        self.assertFalse(f.is_valid())
+        self.assertTrue('a' in f.errors)
+        self.assertTrue('name="b"' in str(f['b']))
+        self.assertTrue(dict(f.fields.items())['b'] is Form.base_fields['b'])
+        f.fields['b'].required = True
+        self.assertFalse(Form.base_fields['b'].required)
+        self.assertFalse(f.fields['b'] is Form.base_fields['b'])
+        self.assertTrue(f.fields['b'] is f.fields['b'])
+        f = Form({'a': 1})
+        self.assertTrue(f.is_valid())
+        self.assertFalse(f.fields.copied)
+        
+        class Form(QueryForm):
+            a, b = Field(required=False), Field(required=False)
+            field_order = ['b', 'a']
+            
+            class Meta:
+                copy_fields_on_write = True
+        
+        f = Form({'a': 1})
+        self.assertTrue(isinstance(f.fields, CopyOnWriteFields))
+        if django.VERSION >= (1, 9):
+            self.assertEqual(list(f.fields), ['b', 'a'])
+        f.fields['a'].label = 'x'
+        self.assertEqual(Form.base_fields['a'].label, None)
+        self.assertEqual(Form().fields['a'].label, None)
+        self.assertTrue(f.is_valid())
+        
+        class Form(QueryModelForm):
+            class Meta:
+                model = User
+                fields = ('username', 'email', 'first_name', 'last_name', 'groups')
+                copy_fields_on_write = True
+        
+        f = Form({'username': 'user'})
+        self.assertEqual(f.fields.copied, set(['groups']))
+        self.assertTrue(f.is_valid())
+        self.assertEqual(f.fields.copied, set(['groups']))
+        self.assertFalse(dict(f.fields.items())['groups'] is Form.base_fields['groups'])
+        User.objects.create(username='user')
+        f = Form({'username': 'user', 'email': 'invalid'})
+        self.assertFalse(f.is_valid())
+        self.assertEqual(sorted(f.errors), ['email', 'username'])
+        self.assertEqual(f.fields.copied, set(['groups']))
+        f.fields['email'].required = True
+        self.assertEqual(f.fields.copied, set(['groups', 'email']))
+        self.assertFalse(Form.base_fields['email'].required)
+        
     def test_ignore(self):
         
         class Form(QueryForm):
@@ -518,34 +1189,299 @@ class QueryFormTestCase(TestCase):
         assert len(logic) == 4
         
         assert isinstance(logic[0], AND)
-        assert isinstance(logic[0].operands[0], Field)
-        assert isinstance(logic[0].operands[1], Field)
-        assert isinstance(logic[0].operands[2], Field)
+        assert logic[0].operands[0] == 'b'
+        assert logic[0].operands[1] == 'c'
+        assert logic[0].operands[2] == 'd'
         assert str(logic[0]) == "( b AND c AND d )"
         assert len(logic[0]) == 3
         
         assert isinstance(logic[1], OR)
-        assert isinstance(logic[1].operands[0], Field)
-        assert isinstance(logic[1].operands[1], Field)
-        assert isinstance(logic[1].operands[2], Field)
+        assert logic[1].operands[0] == 'e'
+        assert logic[1].operands[1] == 'a'
+        assert logic[1].operands[2] == 'f'
         assert str(logic[1]) == "( e OR a OR f )"
         assert len(logic[1]) == 3
         
         assert isinstance(logic[2], AND)
-        assert isinstance(logic[2].operands[0], Field)
+        assert logic[2].operands[0] == 'c'
         assert isinstance(logic[2].operands[1], OR)
-        assert isinstance(logic[2].operands[2], Field)
-        assert isinstance(logic[2].operands[1].operands[0], Field)
-        assert isinstance(logic[2].operands[1].operands[1], Field)
+        assert logic[2].operands[2] == 'a'
+        assert logic[2].operands[1].operands[0] == 'd'
+        assert logic[2].operands[1].operands[1] == 'e'
         assert str(logic[2]) == "( c AND ( d OR e ) AND a )", str(logic[2])
         assert len(logic[2]) == 4
                 
         assert isinstance(logic[3], OR)
         assert isinstance(logic[3].operands[0], AND)
-        assert isinstance(logic[3].operands[1], Field)
-        assert isinstance(logic[3].operands[0].operands[0], Field)
-        assert isinstance(logic[3].operands[0].operands[1], Field)
-        assert isinstance(logic[3].operands[0].operands[2], Field)
+        assert logic[3].operands[1] == 'e'
+        assert logic[3].operands[0].operands[0] == 'b'
+        assert logic[3].operands[0].operands[1] == 'c'
+        assert logic[3].operands[0].operands[2] == 'd'
         assert str(logic[3]) == "( ( b AND c AND d ) OR e )" 
         assert len(logic[3]) == 4
-        
\ No newline at end of file
+        assert logic[3].iter_all_operands() == ('b', 'c', 'd', 'e')
+        assert str(OR('a')) == "( a )"
+
+    def test_compiled_extralogic(self):
+        
+        class Form(QueryForm):
+            a, b, c, d, e, f = A, B, C, D, E, F
+    
+            class Meta:
+                extralogic = [
+                    AND('b', 'c', 'd'),
+                    OR('e', 'a', 'f', required=True),
+                    AND('c', OR('d', 'e'), 'a'),
+                    OR(AND('b', 'c', 'd'), 'e'),
+                    AND('a', OR('b', AND('c', 'd', required=True))),
+                    OR(OR('a', 'b'), AND('e', 'f')),
+                ]
+        
+        def outcome(call, *args):
+            try:
+                return call(*args)
+            except ValidationError as e:
+                return (e.messages, e.subject, e.subjects)
+        
+        names = list(Form.base_fields)
+        positions = Form._meta.positions
+        for i in range(2 ** len(names)):
+            data = dict((n,1) for j,n in enumerate(names) if i & (1 << j))
+            present = sum(positions[n] for n in data)
+            for rule in Form._meta.extralogic:
+                self.assertEqual(
+                    outcome(rule.is_valid, data), outcome(rule.evaluate, present))
+
+    def test_instrumentation(self):
+        import socket
+        from . import instrumentation
+        
+        class Form(QueryModelForm):
+            class Meta:
+                model = User
+                fields = ('username', 'email')
+                extralogic = [AND('username', 'email'),]
+        
+        def view(request, pk):
+            return HttpResponse('success')
+        
+        user = User.objects.create(username='user', email='user@email')
+        factory = RequestFactory()
+        wrapper = validate(Form)(view)
+        recorder = instrumentation.MemoryRecorder()
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        statsd = instrumentation.StatsdRecorder(port=server.getsockname()[1])
+        
+        wrapper(factory.get('', {'username':'user'}), pk=user.pk)
+        self.assertFalse(recorder.timings)
+        instrumentation.add_recorder(recorder)
+        instrumentation.add_recorder(statsd)
+        try:
+            wrapper(factory.get('', {'username':'user'}), pk=user.pk)
+            wrapper(factory.get('', {'username':'user', 'email':'1@email.com'}), pk=user.pk)
+            request = factory.get('', {'username':'user', 'email':'1@email.com'})
+            wrapper(request, pk=user.pk)
+            dict(request.form.parameters)
+        finally:
+            instrumentation.remove_recorder(recorder)
+            instrumentation.remove_recorder(statsd)
+        wrapper(factory.get('', {'username':'user'}), pk=user.pk)
+        
+        label = '%s.%s' %(Form.__module__, Form.__name__)
+        phases = dict((phase, stats[0]) for (name,phase),stats in recorder.timings.items()
+                      if name == label)
+        self.assertEqual(phases, {
+            'get_instance': 3, 'full_clean': 3, 'clean_extralogic': 3,
+            'set_validated_data': 3, 'get_parameters': 1,
+        })
+        self.assertEqual(recorder.counters[(label, 'forms_built', None)], 3)
+        self.assertEqual(recorder.counters[(label, 'rules_evaluated', None)], 3)
+        self.assertEqual(recorder.counters[(label, 'rule_failures', '( username AND email )')], 1)
+        text = recorder.as_prometheus()
+        self.assertTrue('alo_phase_seconds_count{form="%s",phase="full_clean"} 3' %label in text)
+        self.assertTrue('alo_rule_failures_total{form="%s",rule="( username AND email )"} 1' %label in text)
+        
+        lines = [server.recv(1024).decode('utf-8') for i in range(20)]
+        server.close()
+        name = 'alo.%s' %label.replace('.', '_')
+        self.assertTrue('%s.forms_built:1|c' %name in lines)
+        self.assertTrue('%s.rule_failures._username_AND_email_:1|c' %name in lines)
+        self.assertEqual(len([each for each in lines if each.startswith(name + '.full_clean:')]), 3)
+
+    def test_profiling(self):
+        import tempfile
+        from django.core.management import call_command
+        from django.test.utils import override_settings
+        from .profiling import ProfilingMiddleware, summarize, load_samples
+        try:
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+        
+        class Form(QueryForm):
+            a, b = A, B
+    
+            class Meta:
+                extralogic = [AND('a', 'b'),]
+        
+        @validate(Form)
+        def view(request):
+            list(User.objects.all())
+            return HttpResponse('success')
+        
+        factory = RequestFactory()
+        path = tempfile.mktemp()
+        try:
+            with override_settings(ALO_PROFILE_FILE=path, ALO_PROFILE_RATE=1):
+                middleware = ProfilingMiddleware()
+                for data in [{'a':1}, {'a':1, 'b':1}, {'a':1}]:
+                    request = factory.get('/search/', data)
+                    request.resolver_match = type('Match', (), {'view_name': 'search'})()
+                    middleware.process_request(request)
+                    middleware.process_response(request, view(request))
+                middleware.rate = 0
+                request = factory.get('/search/', {'a':1})
+                middleware.process_request(request)
+                middleware.process_response(request, view(request))
+                
+                samples = load_samples(path)
+                self.assertEqual(len(samples), 3)
+                label = '%s.%s' %(Form.__module__, Form.__name__)
+                report = summarize(samples)
+                name, count, alo, query = report['urls'][0]
+                self.assertEqual((name, count), ('search', 3))
+                self.assertTrue(alo[0] > 0)
+                from django.db import connection
+                if hasattr(connection, 'execute_wrappers'):
+                    self.assertTrue(query[2] > 0)
+                self.assertEqual(report['forms'][0][:2], (label, 3))
+                self.assertEqual(report['rules'], [(label, '( a AND b )', 2)])
+                
+                out = StringIO()
+                call_command('alo_profile', stdout=out, clear=True)
+                self.assertTrue('3 sampled requests' in out.getvalue())
+                self.assertTrue(label in out.getvalue())
+                self.assertEqual(load_samples(path), [])
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        from . import instrumentation
+        self.assertEqual(instrumentation.RECORDERS, [])
+
+    def test_clean_extralogic_single_pass(self):
+        
+        class Form(QueryForm):
+            a, b, c, d = A, B, C, D
+            e = Field(required=False, initial='x')
+            f = Field(required=False, initial='y')
+    
+            class Meta:
+                extralogic = [
+                    OR('a', 'e'),
+                    AND('b', 'f'),
+                    OR(AND('c', 'd'), 'f'),
+                    AND('a', OR('c', 'e')),
+                ]
+        
+        def reference(data):
+            # Rule by rule, popping from the validated data as it goes
+            validated = {}
+            for name,field in Form.base_fields.items():
+                if name in data:
+                    validated[name] = (data[name], False)
+                elif field.initial:
+                    validated[name] = (field.initial, True)
+            alternatives, errors = {}, {}
+            for rule in Form._meta.extralogic:
+                try:
+                    result = rule.is_valid(validated)
+                except ValidationError as e:
+                    for name in rule.iter_all_operands():
+                        if name in validated:
+                            if validated[name][1]:
+                                validated.pop(name)
+                            else:
+                                errors.setdefault(name, e.messages)
+                                break
+                        elif rule.required:
+                            errors.setdefault(name, e.messages)
+                            break
+                else:
+                    if isinstance(rule, OR):
+                        for name in rule.iter_all_operands():
+                            if name != result and name in validated:
+                                value, defaulted = validated.pop(name)
+                                if not defaulted:
+                                    alternatives[name] = value
+            validated = dict((k, v[0]) for k,v in validated.items())
+            return validated, alternatives, sorted(errors)
+        
+        names = list(Form.base_fields)
+        for i in range(2 ** len(names)):
+            data = dict((n, n) for j,n in enumerate(names) if i & (1 << j))
+            form = Form(data)
+            form.is_valid()
+            self.assertEqual(
+                (form._validated_data, form._alternatives, sorted(form.errors)),
+                reference(data))
+
+    def test_lazy_parameters(self):
+        calls = []
+        
+        def count(name, lookup):
+            def call(*values):
+                calls.append(name)
+                return {lookup: values}
+            return call
+        
+        class Form(QueryForm):
+            a, b, c, d, e = A, B, C, D, E
+            
+            class Meta:
+                lookups = {'e': 'e__icontains'}
+                multifield_lookups = {
+                    ('a', 'b'): count('ab', 'a__range'),
+                    ('c', 'd'): count('cd', 'c__range'),
+                }
+        
+        f = Form({'a': '1', 'b': '2', 'c': '3', 'd': '4', 'e': '5'})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(f.parameters['e__icontains'], '5')
+        self.assertEqual(calls, [])
+        self.assertEqual(f.parameters['a__range'], ('1', '2'))
+        self.assertEqual(sorted(calls), ['ab', 'cd'])
+        self.assertEqual(f.parameters, {
+            'e__icontains': '5', 'a__range': ('1', '2'), 'c__range': ('3', '4')})
+        self.assertEqual(len(calls), 2)
+        
+        f._validated_data['a'] = '0'
+        self.assertEqual(f.parameters['a__range'], ('0', '2'))
+        self.assertEqual(f.parameters['c__range'], ('3', '4'))
+        self.assertEqual(sorted(calls), ['ab', 'ab', 'cd'])
+        del f._validated_data['d']
+        self.assertFalse('c__range' in f.parameters)
+        self.assertFalse('a' in f.parameters)
+        
+        f.parameters['tenant'] = 1
+        del f.parameters['e__icontains']
+        self.assertRaises(KeyError, f.parameters.__delitem__, 'e__icontains')
+        self.assertEqual(f.get_parameters(), {'a__range': ('0', '2'), 'tenant': 1})
+        self.assertEqual(sorted(f.as_q().children), [('a__range', ('0', '2')), ('tenant', 1)])
+        f._validated_data['e'] = '6'
+        self.assertFalse('e__icontains' in f.parameters)
+        f.parameters['e__icontains'] = '7'
+        self.assertEqual(f.parameters['e__icontains'], '7')
+        
+        class Form(QueryForm):
+            a, b, c = A, B, C
+            
+            class Meta:
+                lookups = {'c': 'a__range'}
+                multifield_lookups = {('a', 'b'): count('ab', 'a__range')}
+        
+        f = Form({'a': '1', 'b': '2', 'c': '3'})
+        self.assertTrue(f.is_valid())
+        self.assertEqual(f.parameters['a__range'], '3')
+        self.assertEqual(f.get_parameters(), {'a__range': '3'})